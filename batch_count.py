@@ -0,0 +1,250 @@
+import argparse
+import csv
+import json
+import os
+import queue
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+from src.config import load_config
+from src.detector import Detector
+from src.image_processing import ImageProcessor
+from src.log import get_logger, setup_logging
+from src.storage import THUMBNAIL_SUFFIX
+
+log = get_logger('batch_count')
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp')
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mkv', '.mov')
+#images saved by DataHandler carry the live count and weight, kept so re-counts can be compared
+SAVED_IMAGE_PATTERN = re.compile(r"chicken_count_(\d+)_date_.*_weight_(-?[\d.]+)$")
+FIELDS = ['source', 'frame', 'count', 'mean_conf', 'width', 'height', 'previous_count', 'weight']
+
+def find_inputs(paths):
+    #expands directories (recursively, sorted) into image and video files, thumbnails are skipped
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, filenames in os.walk(path):
+                dirs.sort()
+                for filename in sorted(filenames):
+                    yield from find_inputs([os.path.join(root, filename)])
+            continue
+        stem, ext = os.path.splitext(path)
+        if ext.lower() in IMAGE_EXTENSIONS and not stem.endswith(THUMBNAIL_SUFFIX):
+            yield 'image', path
+        elif ext.lower() in VIDEO_EXTENSIONS:
+            yield 'video', path
+        elif not os.path.exists(path):
+            log.warning("Input %s not found, skipping", path)
+
+def read_image(path):
+    frame = cv2.imread(path)
+    if frame is None:
+        log.warning("Could not read %s, skipping", path)
+    return path, None, frame
+
+def read_video(path, stride):
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        log.warning("Could not open video %s, skipping", path)
+        return
+    index = 0
+    try:
+        while True:
+            #grab() skips decoding the frames between strides
+            if index % stride and cap.grab():
+                index += 1
+                continue
+            ret, frame = cap.read()
+            if not ret:
+                break
+            yield path, index, frame
+            index += 1
+    finally:
+        cap.release()
+
+def decoded_frames(inputs, workers, stride):
+    #images are decoded on a thread pool with a bounded lookahead, in input order, videos are read in sequence
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="decode") as executor:
+        pending = deque()
+        for kind, path in inputs:
+            if kind == 'video':
+                while pending:
+                    yield pending.popleft().result()
+                yield from read_video(path, stride)
+                continue
+            pending.append(executor.submit(read_image, path))
+            if len(pending) >= workers * 4:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def prefetch(iterable, depth):
+    #runs iterable on a background thread so decoding overlaps with inference
+    items = queue.Queue(maxsize=depth)
+    done = object()
+
+    def produce():
+        try:
+            for item in iterable:
+                items.put(item)
+        except Exception as e:
+            items.put(e)
+        items.put(done)
+
+    threading.Thread(target=produce, name="prefetch", daemon=True).start()
+    while True:
+        item = items.get()
+        if item is done:
+            return
+        if isinstance(item, Exception):
+            raise item
+        yield item
+
+def batched(iterable, size):
+    batch = []
+    for item in iterable:
+        if item[2] is None:
+            continue
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+class ResultWriter:
+    #one row per frame, CSV or JSON lines depending on the output extension
+    def __init__(self, path, output_format=None):
+        self.format = output_format or ('jsonl' if path.endswith(('.jsonl', '.json')) else 'csv')
+        self.file = open(path, 'w', newline='')
+        self.csv = None
+        if self.format == 'csv':
+            self.csv = csv.DictWriter(self.file, fieldnames=FIELDS)
+            self.csv.writeheader()
+
+    def write(self, row):
+        if self.csv is not None:
+            self.csv.writerow(row)
+        else:
+            self.file.write(json.dumps(row) + "\n")
+
+    def close(self):
+        self.file.close()
+
+class BatchCounter:
+    def __init__(self, config, annotate_dir=None, input_root=None):
+        self.config = config
+        self.detector = Detector(config)
+        self.image_processor = ImageProcessor(config)
+        self.annotate_dir = annotate_dir
+        self.input_root = input_root
+        self._roi = {}
+
+    def _roi_params(self, shape):
+        #center, radius and mask per frame size, archives can mix resolutions
+        key = shape[:2]
+        if key not in self._roi:
+            height, width = key
+            center, radius = self.image_processor.get_roi_params(width, height)
+            mask = self.image_processor.create_circular_mask((height, width), center, radius)
+            self._roi[key] = (center, radius, mask)
+        return self._roi[key]
+
+    def count(self, batch):
+        rois, offsets = [], []
+        for _, _, frame in batch:
+            center, radius, mask = self._roi_params(frame.shape)
+            if self.image_processor.roi_mode == 'crop':
+                roi, offset = self.image_processor.get_roi_crop(frame, mask, center, radius)
+            else:
+                roi, offset = self.image_processor.get_roi(frame, mask), (0, 0)
+            rois.append(roi)
+            offsets.append(offset)
+
+        results = self.detector.detect_batch(rois)
+        rows = []
+        for (source, index, frame), result, offset in zip(batch, results, offsets):
+            if offset != (0, 0):
+                result.translate(*offset)
+            count = len(result.boxes)
+            row = {
+                'source': source,
+                'frame': index,
+                'count': count,
+                'mean_conf': round(float(result.boxes.conf.mean()), 4) if count else None,
+                'width': frame.shape[1],
+                'height': frame.shape[0],
+                'previous_count': None,
+                'weight': None,
+            }
+            match = SAVED_IMAGE_PATTERN.search(os.path.splitext(os.path.basename(source))[0])
+            if match:
+                row['previous_count'], row['weight'] = int(match.group(1)), float(match.group(2))
+            rows.append(row)
+            if self.annotate_dir:
+                self.annotate(source, index, frame, count, result)
+        return rows
+
+    def annotate(self, source, index, frame, count, result):
+        center, radius, _ = self._roi_params(frame.shape)
+        self.image_processor.draw_roi(frame, center, radius, out=frame)
+        self.image_processor.draw_results(frame, count, [result], out=frame)
+        #mirror the input layout so annotated archives stay sharded by date
+        relative = os.path.relpath(source, self.input_root) if self.input_root else os.path.basename(source)
+        if relative.startswith(".."):
+            relative = os.path.basename(source)
+        stem = os.path.splitext(relative)[0]
+        path = os.path.join(self.annotate_dir, f"{stem}_{index:06d}.jpg" if index is not None else f"{stem}.jpg")
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        cv2.imwrite(path, frame)
+
+def main():
+    parser = argparse.ArgumentParser(description="Count chickens in image folders and recorded videos")
+    parser.add_argument("inputs", nargs="+", help="image files, video files or directories (searched recursively)")
+    parser.add_argument("--config", default="config.yaml", help="path to the configuration file")
+    parser.add_argument("--output", default="counts.csv", help="results file, .csv or .jsonl")
+    parser.add_argument("--format", choices=["csv", "jsonl"], help="overrides the format implied by --output")
+    parser.add_argument("--annotate", metavar="DIR", help="also write annotated images to DIR")
+    parser.add_argument("--batch-size", type=int, help="frames per model call, defaults to inference.max_batch")
+    parser.add_argument("--decode-workers", type=int, default=4, help="threads decoding images")
+    parser.add_argument("--stride", type=int, default=1, help="count every Nth video frame")
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    setup_logging(config)
+    batch_size = args.batch_size or max(1, config['inference'].get('max_batch', 4))
+    input_root = args.inputs[0] if len(args.inputs) == 1 and os.path.isdir(args.inputs[0]) else None
+
+    counter = BatchCounter(config, args.annotate, input_root)
+    writer = ResultWriter(args.output, args.format)
+    frames = prefetch(decoded_frames(find_inputs(args.inputs), args.decode_workers, max(1, args.stride)),
+                      depth=batch_size * 2)
+    start = time.perf_counter()
+    processed = 0
+    next_report = 500
+    counts = []
+    try:
+        for batch in batched(frames, batch_size):
+            for row in counter.count(batch):
+                writer.write(row)
+                counts.append(row['count'])
+            processed += len(batch)
+            if processed >= next_report:
+                next_report += 500
+                log.info("Counted %d frames, %.1f frames/s", processed, processed / (time.perf_counter() - start))
+    except KeyboardInterrupt:
+        log.info("Stopping, results so far are in %s", args.output)
+    finally:
+        writer.close()
+
+    elapsed = time.perf_counter() - start
+    log.info("Counted %d frames in %.1fs (%.1f frames/s), mean count %.2f, results in %s", processed, elapsed,
+             processed / elapsed if elapsed else 0, float(np.mean(counts)) if counts else 0, args.output)
+
+if __name__ == "__main__":
+    main()
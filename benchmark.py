@@ -0,0 +1,346 @@
+import argparse
+import contextlib
+import copy
+import glob
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from collections import defaultdict
+import cv2
+import numpy as np
+import yaml
+from src.config import apply_env_overrides, validate
+
+#default model per backend, --model backend=path overrides them
+MODEL_PATHS = {
+    'ultralytics': 'model/ChickenCounterV4.pt',
+    'ncnn': 'model/ChickenCounterV4_ncnn_model',
+    'onnx': 'model/ChickenCounterV4.onnx',
+    'openvino': 'model/ChickenCounterV4_openvino_model',
+}
+STAGES = ['capture', 'roi', 'detect', 'draw', 'save', 'publish', 'log', 'total']
+
+class PublishInfo:
+    rc = 0
+
+class NullMQTTClient:
+    #stands in for the paho client under a real MQTTHandler, so payloads, encoding and the publisher
+    #thread are the production ones and only the network is left out
+    def __init__(self):
+        self.published = 0
+        self.bytes = 0
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        self.published += 1
+        self.bytes += len(payload)
+        return PublishInfo()
+
+    def connect_async(self, host, port, keepalive):
+        pass
+
+    def subscribe(self, topic):
+        pass
+
+    def loop_start(self):
+        pass
+
+    def loop_stop(self):
+        pass
+
+    def disconnect(self):
+        pass
+
+class StubMYSQLHandler:
+    def __init__(self):
+        self.rows = []
+
+    def log_detection(self, timestamp, weight, count, image_path, device_id=None):
+        self.rows.append((timestamp, weight, count, image_path, device_id))
+
+def load_benchmark_config(path, backend, model_path, output_dir):
+    with open(path, 'r') as file:
+        data = validate(apply_env_overrides(yaml.safe_load(file) or {}))
+    data = copy.deepcopy(data)
+    data.pop('stations', None)
+    data['yolo']['backend'] = backend
+    data['yolo']['model_path'] = model_path
+    #every frame is processed in order, so no background capture or pacing
+    data['camera']['threaded'] = False
+    data['display']['headless'] = True
+    data['display']['stream'] = False
+    data['output']['directory'] = output_dir
+    data['output']['max_size_mb'] = 0
+    data['output']['max_age_days'] = 0
+    data['mqtt']['spool_path'] = os.path.join(output_dir, 'mqtt_spool.jsonl')
+    return data
+
+def video_frames(config, video, limit):
+    from src.camera import Camera
+    config = copy.deepcopy(config)
+    config['camera']['device_id'] = video
+    camera = Camera(config)
+    camera.initialize()
+    try:
+        for _ in range(limit):
+            start = time.perf_counter()
+            ret, frame = camera.cap.read()
+            if not ret:
+                break
+            yield frame, time.perf_counter() - start
+    finally:
+        camera.release()
+
+def image_frames(paths, limit):
+    #images are cycled until limit frames, each read includes the JPEG decode
+    for i in range(limit if paths else 0):
+        start = time.perf_counter()
+        frame = cv2.imread(paths[i % len(paths)])
+        if frame is None:
+            print(f"Could not read {paths[i % len(paths)]}, skipping")
+            continue
+        yield frame, time.perf_counter() - start
+
+def summarize(samples):
+    values = np.array(samples) * 1000
+    return {
+        'count': int(len(values)),
+        'mean_ms': round(float(values.mean()), 3),
+        'p50_ms': round(float(np.percentile(values, 50)), 3),
+        'p95_ms': round(float(np.percentile(values, 95)), 3),
+        'p99_ms': round(float(np.percentile(values, 99)), 3),
+        'max_ms': round(float(values.max()), 3),
+    }
+
+def run_source(config, source, frames, warmup):
+    from src.data_handler import DataHandler
+    from src.detector import Detector
+    from src.image_processing import ImageProcessor
+    from src.mqtt_handler import MQTTHandler
+
+    load_start = time.perf_counter()
+    detector = Detector(config)
+    load_seconds = time.perf_counter() - load_start
+    warmup_start = time.perf_counter()
+    for _ in range(warmup):
+        detector.warmup()
+    warmup_seconds = time.perf_counter() - warmup_start
+
+    image_processor = ImageProcessor(config)
+    data_handler = DataHandler(config)
+    mqtt_handler = MQTTHandler(config)
+    mqtt_handler.client = NullMQTTClient()
+    mqtt_handler.connect()
+    #what paho would do once the broker accepts the connection
+    mqtt_handler.on_connect(mqtt_handler.client, None, {}, 0)
+    mysql_handler = StubMYSQLHandler()
+
+    timings = defaultdict(list)
+    counts = []
+    mask_key = None
+    wall_start = time.perf_counter()
+    for frame, capture_seconds in frames:
+        frame_start = time.perf_counter()
+        timings['capture'].append(capture_seconds)
+
+        start = time.perf_counter()
+        height, width = frame.shape[:2]
+        if mask_key != (width, height):
+            center, radius = image_processor.get_roi_params(width, height)
+            mask = image_processor.create_circular_mask((height, width), center, radius)
+            mask_key = (width, height)
+        if image_processor.roi_mode == 'crop':
+            roi, offset = image_processor.get_roi_crop(frame, mask, center, radius)
+        else:
+            roi, offset = image_processor.get_roi(frame, mask), (0, 0)
+        timings['roi'].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        results = detector.detect_batch([roi])
+        if offset != (0, 0):
+            results[0].translate(*offset)
+        count = len(results[0].boxes)
+        timings['detect'].append(time.perf_counter() - start)
+        counts.append(count)
+
+        start = time.perf_counter()
+        image_processor.draw_roi(frame, center, radius, out=frame)
+        result_frame = image_processor.draw_results(frame, count, results, out=frame)
+        timings['draw'].append(time.perf_counter() - start)
+
+        #every frame takes the publish path so the stages are comparable even with no chickens in view
+        weight = 10.0
+        time_triggered = time.strftime("%Y-%m-%d %H:%M:%S")
+        start = time.perf_counter()
+        image_path = data_handler.save_frame(result_frame, count, weight, copy=False)
+        timings['save'].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        mqtt_handler.publish_data(time_triggered, weight, count, image_path, 'benchmark')
+        timings['publish'].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        mysql_handler.log_detection(time_triggered, weight, count, image_path, 'benchmark')
+        timings['log'].append(time.perf_counter() - start)
+        timings['total'].append(time.perf_counter() - frame_start + capture_seconds)
+
+    #the background image writer and publisher are part of the pipeline, so their backlog counts toward the wall time
+    flush_start = time.perf_counter()
+    data_handler.flush()
+    data_handler.close()
+    mqtt_handler.disconnect()
+    flush_seconds = time.perf_counter() - flush_start
+    wall_seconds = time.perf_counter() - wall_start
+
+    processed = len(timings['total'])
+    if processed == 0:
+        return None
+    return {
+        'source': source,
+        'frames': processed,
+        'model_load_seconds': round(load_seconds, 3),
+        'warmup_seconds': round(warmup_seconds, 3),
+        'wall_seconds': round(wall_seconds, 3),
+        'save_flush_seconds': round(flush_seconds, 3),
+        'throughput_fps': round(processed / wall_seconds, 2),
+        'mean_count': round(float(np.mean(counts)), 3),
+        'published_messages': mqtt_handler.client.published,
+        'published_bytes': mqtt_handler.client.bytes,
+        'stages': {stage: summarize(timings[stage]) for stage in STAGES},
+    }
+
+def peak_rss_mb():
+    #ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def run_backend(args, backend, model_path):
+    output_dir = tempfile.mkdtemp(prefix="smart_scale_benchmark_")
+    try:
+        config = load_benchmark_config(args.config, backend, model_path, output_dir)
+        runs = []
+        if args.video:
+            if os.path.exists(args.video):
+                runs.append(run_source(config, 'video', video_frames(config, args.video, args.frames), args.warmup))
+            else:
+                print(f"Video {args.video} not found, skipping")
+        paths = sorted(glob.glob(args.images)) if args.images else []
+        if args.images and not paths:
+            print(f"No images match {args.images}, skipping")
+        if paths:
+            runs.append(run_source(config, 'images', image_frames(paths, args.frames), args.warmup))
+        return {
+            'backend': backend,
+            'model_path': model_path,
+            'imgsz': config['yolo'].get('imgsz', 640),
+            'threads': config['yolo'].get('threads', 4),
+            'roi_mode': config['roi'].get('mode', 'mask'),
+            'runs': [run for run in runs if run is not None],
+            'peak_rss_mb': peak_rss_mb(),
+        }
+    except Exception as e:
+        return {'backend': backend, 'model_path': model_path, 'error': f"{type(e).__name__}: {e}"}
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+def _run_backend_process(args, backend, model_path, results):
+    if args.output == '-':
+        #stdout carries only the JSON report, whatever the backend prints goes to stderr, native libraries included
+        os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    results.put(run_backend(args, backend, model_path))
+
+def run_isolated(args, backend, model_path):
+    #each backend runs in a fresh process so model memory and peak RSS do not leak between them
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=_run_backend_process, args=(args, backend, model_path, results))
+    process.start()
+    deadline = time.monotonic() + args.timeout
+    while True:
+        try:
+            result = results.get(timeout=1.0)
+            break
+        except queue.Empty:
+            pass
+        #a segfault in a native backend or the OOM killer ends the process without a result
+        if not process.is_alive():
+            try:
+                result = results.get(timeout=1.0)
+                break
+            except queue.Empty:
+                process.join()
+                return {'backend': backend, 'model_path': model_path,
+                        'error': f"benchmark process died with exit code {process.exitcode}"}
+        if time.monotonic() > deadline:
+            process.terminate()
+            process.join()
+            return {'backend': backend, 'model_path': model_path, 'error': f"timed out after {args.timeout}s"}
+    process.join()
+    return result
+
+def print_summary(report):
+    for backend in report['backends']:
+        if 'error' in backend:
+            print(f"{backend['backend']}: failed, {backend['error']}")
+            continue
+        for run in backend['runs']:
+            print(f"{backend['backend']} {run['source']}: {run['frames']} frames, {run['throughput_fps']} fps, "
+                  f"peak RSS {backend['peak_rss_mb']} MB, model load {run['model_load_seconds']}s")
+            for stage in STAGES:
+                stats = run['stages'][stage]
+                print(f"  {stage:<8} p50 {stats['p50_ms']:>8.2f} ms  p95 {stats['p95_ms']:>8.2f} ms  "
+                      f"p99 {stats['p99_ms']:>8.2f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the capture, ROI, detect and publish pipeline")
+    parser.add_argument("--config", default="config.yaml", help="path to the configuration file")
+    parser.add_argument("--backends", nargs="+", default=["ultralytics", "ncnn"],
+                        help="inference backends to compare")
+    parser.add_argument("--model", action="append", default=[], metavar="BACKEND=PATH",
+                        help="model path for a backend, may be repeated")
+    parser.add_argument("--video", default="manual_val/Video2.mp4", help="video replayed frame by frame, '' to skip")
+    parser.add_argument("--images", default="manual_val/Image*.jpg", help="image glob, '' to skip")
+    parser.add_argument("--frames", type=int, default=200, help="frames per source")
+    parser.add_argument("--warmup", type=int, default=3, help="warmup inferences before timing")
+    parser.add_argument("--output", default="benchmark.json", help="JSON report path, '-' for stdout")
+    parser.add_argument("--timeout", type=float, default=1800, help="seconds before a backend run is abandoned")
+    args = parser.parse_args()
+
+    model_paths = dict(MODEL_PATHS)
+    for item in args.model:
+        backend, _, path = item.partition("=")
+        model_paths[backend] = path
+
+    report = {
+        'created': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'machine': {
+            'platform': platform.platform(),
+            'processor': platform.machine(),
+            'cpu_count': os.cpu_count(),
+            'python': platform.python_version(),
+            'opencv': cv2.__version__,
+        },
+        'settings': {'frames': args.frames, 'warmup': args.warmup, 'video': args.video, 'images': args.images},
+        'backends': [],
+    }
+    #with --output - the progress lines and summary go to stderr, so stdout parses as JSON
+    with contextlib.redirect_stdout(sys.stderr if args.output == '-' else sys.stdout):
+        for backend in args.backends:
+            print(f"Benchmarking {backend} ({model_paths.get(backend)})")
+            report['backends'].append(run_isolated(args, backend, model_paths.get(backend)))
+        print_summary(report)
+    if args.output == '-':
+        print(json.dumps(report, indent=2))
+    else:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+        print(f"Report written to {args.output}")
+
+if __name__ == "__main__":
+    main()
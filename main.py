@@ -1,58 +1,170 @@
-import cv2
-from datetime import datetime
-from src.camera import Camera
-from src.image_processing import ImageProcessor
-from src.mqtt_handler import MQTTHandler
+import time
+STARTUP_TIME = time.perf_counter()
+
+import argparse
+from src.config import load_config
+from src.mqtt_handler import MQTTHandler, MQTT_CONNECTED, PUBLISH_QUEUE
 from src.detector import Detector
-from src.data_handler import DataHandler
-from src.mysql_handler import MYSQLHandler
-
-def main():
-    camera = Camera()
-    image_processor = ImageProcessor()
-    mqtt_handler = MQTTHandler()
-    detector = Detector()
-    data_handler = DataHandler()
-    mysql_handler = MYSQLHandler()
-
-    camera.initialize()
-    mqtt_handler.connect(mqtt_handler.topic_weight)
-
-    frame_width, frame_height = camera.get_dimensions()
-    center, radius = image_processor.get_roi_params(frame_width, frame_height)
-    mask = image_processor.create_circular_mask((frame_height, frame_width), center, radius)
-
-    while True:
-        frame = camera.get_frame()
-        display_frame = image_processor.draw_roi(frame, center, radius)
-        display_frame = cv2.resize(display_frame, (frame_width//2, frame_height//2))
-        cv2.imshow("Chicken Detection", display_frame)
-
-        if mqtt_handler.trigger_processing:
-            time_triggered = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            roi = image_processor.get_roi(frame, mask)
-            results = detector.detect(roi)
-            count = detector.count_chickens(results)
-
-            if count > 0:
-                result_frame = image_processor.draw_results(display_frame, count, results)
-                cv2.imshow("Chicken Detection", result_frame)
-                image_path = data_handler.save_frame(result_frame, count, mqtt_handler.current_weight)
-                mqtt_handler.publish_data(time_triggered, mqtt_handler.current_weight, count, image_path)
-                mysql_handler.log_detection(time_triggered, mqtt_handler.current_weight, count, image_path)
-            else:
-                print("No chickens detected. Skipping data saving and publishing.")
-
-            mqtt_handler.reset_trigger()
-
-        key = cv2.waitKey(1) & 0xFF
-        if key == ord('q'):
-            break
-
-    camera.release()
-    cv2.destroyAllWindows()
-    mqtt_handler.disconnect()
-    mysql_handler.close()
+from src.data_handler import DataHandler, SAVE_QUEUE
+from src.mysql_handler import MYSQLHandler, DB_CONNECTED, WRITE_QUEUE
+from src.inference_pool import InferencePool, TriggerDropped, QUEUE_DEPTH
+from src.startup import StartupProfiler
+from src.log import get_logger, setup_logging
+from src.metrics import counter, start_server
+from src.stations import Station, load_stations
+
+log = get_logger('main')
+DETECTIONS = counter('smart_scale_detections_total', 'Weighings with at least one chicken counted', ['station'])
+EMPTY_RESULTS = counter('smart_scale_empty_results_total', 'Weighings where no chicken was detected', ['station'])
+CHICKENS_COUNTED = counter('smart_scale_chickens_counted_total', 'Chickens counted over all weighings', ['station'])
+INFERENCE_FAILURES = counter('smart_scale_inference_failures_total', 'Inference jobs that raised an error')
+
+def bind_metrics(mqtt_handler, inference_pool, data_handler, mysql_handler):
+    #the gauges read the pipeline's own components, other scripts may build their own handlers without taking them over
+    MQTT_CONNECTED.set_function(lambda: int(mqtt_handler.connected.is_set()))
+    PUBLISH_QUEUE.set_function(mqtt_handler.events.qsize)
+    QUEUE_DEPTH.set_function(inference_pool.jobs.qsize)
+    SAVE_QUEUE.set_function(lambda: len(data_handler.pending))
+    DB_CONNECTED.set_function(lambda: int(mysql_handler.connected.is_set()))
+    WRITE_QUEUE.set_function(mysql_handler.rows.qsize)
+
+def handle_result(result, trigger_frames, station, mqtt_handler, data_handler, mysql_handler, multi_station):
+    #boxes are in full frame coordinates, so draw on the full resolution frame that best shows the count
+    job = result.job
+    if result.count > 0:
+        image_processor = station.image_processor
+        frame = trigger_frames[result.best_index]
+        image_processor.draw_roi(frame, station.center, station.radius, out=frame)
+        result_frame = image_processor.draw_results(frame, result.count, [result.results[result.best_index]], out=frame)
+        station.preview.show(result_frame)
+        image_path = data_handler.save_frame(result_frame, result.count, job.weight, copy=False,
+                                             station_id=station.id if multi_station else None)
+        mqtt_handler.publish_data(job.time_triggered, job.weight, result.count, image_path, station.id)
+        mysql_handler.log_detection(job.time_triggered, job.weight, result.count, image_path, station.id)
+        DETECTIONS.labels(station.id).inc()
+        CHICKENS_COUNTED.labels(station.id).inc(result.count)
+    else:
+        EMPTY_RESULTS.labels(station.id).inc()
+        log.info("No chickens detected on %s. Skipping data saving and publishing.", station.id)
+
+def collect_results(pending, stations, mqtt_handler, data_handler, mysql_handler):
+    #handles finished inference jobs in trigger order and returns the ones still running
+    still_pending = []
+    for future, trigger_frames, station in pending:
+        if not future.done():
+            still_pending.append((future, trigger_frames, station))
+            continue
+        try:
+            result = future.result()
+        except TriggerDropped:
+            continue
+        except Exception as e:
+            INFERENCE_FAILURES.inc()
+            log.error("Inference failed: %s", e)
+            continue
+        handle_result(result, trigger_frames, station, mqtt_handler, data_handler, mysql_handler, len(stations) > 1)
+    return still_pending
+
+def main(config_path='config.yaml', profile_startup=False, headless=False):
+    profiler = StartupProfiler(STARTUP_TIME)
+    profiler.mark("imports done")
+    with profiler.phase("load config"):
+        config = load_config(config_path)
+        setup_logging(config)
+    metrics_port = (config.get('metrics') or {}).get('port', 9100)
+    if metrics_port:
+        #Prometheus text format on http://<host>:<port>/metrics
+        try:
+            start_server((config.get('metrics') or {}).get('host', '127.0.0.1'), metrics_port)
+        except OSError as e:
+            log.warning("Metrics endpoint not started on port %s: %s", metrics_port, e)
+    with profiler.phase("init components"):
+        mqtt_handler = MQTTHandler(config)
+        #the model, database and image writer are shared, each station has its own camera, ROI and preview
+        stations = {}
+        for station_id, station_config in load_stations(config):
+            stations[station_id] = Station(station_id, station_config, mqtt_handler, headless)
+            mqtt_handler.add_station(station_id, station_config)
+        inference_pool = InferencePool(Detector, config)
+        data_handler = DataHandler(config)
+        mysql_handler = MYSQLHandler(config)
+        bind_metrics(mqtt_handler, inference_pool, data_handler, mysql_handler)
+
+    #the model and the database come up in the background while frames are already shown
+    inference_pool.start(profiler)
+    mysql_handler.start(profiler)
+
+    with profiler.phase("camera open"):
+        for station in stations.values():
+            station.initialize()
+    with profiler.phase("mqtt connect"):
+        mqtt_handler.connect()
+
+    vote_frames = config['inference'].get('vote_frames', 1)
+    first_frame = True
+    ready_reported = False
+    pending = []
+
+    try:
+        while True:
+            if config.reload_if_changed():
+                #the radius may have changed for all stations or just one, masks are cached so this is cheap
+                for station in stations.values():
+                    station.update_roi()
+
+            for station in stations.values():
+                station.read()
+                station.show_preview()
+            if first_frame:
+                profiler.mark("first frame captured")
+                first_frame = False
+
+            if not ready_reported and inference_pool.ready.is_set():
+                profiler.mark("model ready")
+                log.info("Detector ready after %.2fs", profiler.elapsed())
+                if profile_startup:
+                    log.info("Startup profile:\n%s", profiler.report())
+                ready_reported = True
+
+            if inference_pool.ready.is_set():
+                for station in stations.values():
+                    if station.tracking:
+                        station.update_tracking(inference_pool, mysql_handler)
+
+            for weight, trigger_time, time_triggered, station_id in mqtt_handler.pop_triggers():
+                station = stations[station_id]
+                trigger_frames, rois, offset, reference_index = station.trigger_frames(trigger_time, vote_frames)
+                #rois and trigger frames are freshly allocated because they outlive this iteration
+                future = inference_pool.submit(rois, weight, trigger_time, time_triggered, offset, reference_index, station_id)
+                pending.append((future, trigger_frames, station))
+
+            pending = collect_results(pending, stations, mqtt_handler, data_handler, mysql_handler)
+
+            #only the first station's window reads keys, one poll per loop is enough
+            key = next(iter(stations.values())).preview.poll_key()
+            if key == ord('q'):
+                break
+    except KeyboardInterrupt:
+        log.info("Stopping")
+    finally:
+        #also on errors such as the end of a video source, the writers are background threads that would
+        #otherwise take their queued rows and events with them
+        inference_pool.stop()
+        try:
+            collect_results(pending, stations, mqtt_handler, data_handler, mysql_handler)
+            for station in stations.values():
+                station.close()
+        finally:
+            data_handler.close()
+            mqtt_handler.disconnect()
+            mysql_handler.close()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Smart scale chicken counter")
+    parser.add_argument("--config", default="config.yaml", help="path to the configuration file")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="print the time spent in each startup phase once the model is ready")
+    parser.add_argument("--headless", action="store_true",
+                        help="run without a local preview window")
+    args = parser.parse_args()
+    main(config_path=args.config, profile_startup=args.profile_startup, headless=args.headless)
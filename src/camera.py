@@ -1,25 +1,162 @@
+import threading
+import time
 import cv2
-import yaml
+import numpy as np
+from src.config import load_config
+from src.metrics import counter, histogram
+
+CAPTURE_SECONDS = histogram('smart_scale_capture_seconds', 'Time to read one frame from the camera', ['camera'])
+FRAMES_CAPTURED = counter('smart_scale_frames_captured_total', 'Frames read from the camera', ['camera'])
 
 class Camera:
-    def __init__(self, config_path='config.yaml'):
-        with open(config_path, 'r') as file:
-            config = yaml.safe_load(file)
-        
+    def __init__(self, config=None):
+        if config is None:
+            config = load_config()
+        self.config = config
+
         self.device_id = config['camera']['device_id']
+        self.threaded = config['camera'].get('threaded', False)
+        self.buffer_size = max(2, config['camera'].get('buffer_size', 4))
+        self.history_mb = config['camera'].get('history_mb', 0)
         self.cap = None
 
+        # ring buffer used by the background capture thread
+        self._buffer = None
+        self._slot_seq = None
+        self._slot_time = None
+        self._seq = -1
+        self._lock = threading.Lock()
+        self._thread = None
+        self._running = False
+        self._error = None
+
     def initialize(self):
         self.cap = cv2.VideoCapture(self.device_id)
         if not self.cap.isOpened():
             raise ValueError(f"Unable to open camera with device ID {self.device_id}")
+        if self.threaded:
+            self.start_capture()
 
-    def get_frame(self):
+    def start_capture(self):
+        #grab the first frame synchronously so the ring buffer can be sized from it
         if self.cap is None:
             raise ValueError("Camera is not initialized")
         ret, frame = self.cap.read()
         if not ret:
             raise ValueError("Failed to capture frame")
+
+        #keep as many frames as the memory budget allows so triggers can look back in time
+        history_frames = int(self.history_mb * 1024 * 1024) // frame.nbytes
+        self.buffer_size = max(self.buffer_size, history_frames)
+
+        self._buffer = np.empty((self.buffer_size,) + frame.shape, dtype=frame.dtype)
+        self._slot_seq = np.full(self.buffer_size, -1, dtype=np.int64)
+        self._slot_time = np.zeros(self.buffer_size, dtype=np.float64)
+        self._buffer[0] = frame
+        self._slot_seq[0] = 0
+        self._slot_time[0] = time.monotonic()
+        self._seq = 0
+
+        self._running = True
+        self._thread = threading.Thread(target=self._capture_loop, daemon=True)
+        self._thread.start()
+
+    def _capture_loop(self):
+        #video files decode faster than real time, so pace them at their native fps
+        frame_interval = 0.0
+        if isinstance(self.device_id, str):
+            fps = self.cap.get(cv2.CAP_PROP_FPS)
+            frame_interval = 1.0 / fps if fps > 0 else 0.0
+        next_time = time.monotonic()
+        capture_seconds = CAPTURE_SECONDS.labels(self.device_id)
+        frames_captured = FRAMES_CAPTURED.labels(self.device_id)
+
+        while self._running:
+            slot = (self._seq + 1) % self.buffer_size
+            target = self._buffer[slot]
+            # the slot about to be overwritten is the oldest one, never the latest
+            start = time.perf_counter()
+            ret, frame = self.cap.read(target)
+            capture_seconds.observe(time.perf_counter() - start)
+            if not ret:
+                self._error = "Failed to capture frame"
+                self._running = False
+                break
+            if frame is not target:
+                np.copyto(target, frame)
+
+            frames_captured.inc()
+            with self._lock:
+                self._seq += 1
+                self._slot_seq[slot] = self._seq
+                self._slot_time[slot] = time.monotonic()
+
+            if frame_interval:
+                next_time += frame_interval
+                delay = next_time - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    next_time = time.monotonic()
+
+    def read_latest(self):
+        #returns a read-only view of the newest frame with its sequence number and capture time
+        if self._buffer is None:
+            raise ValueError("Camera capture thread is not running")
+        with self._lock:
+            slot = self._seq % self.buffer_size
+            seq = int(self._slot_seq[slot])
+            timestamp = float(self._slot_time[slot])
+        frame = self._buffer[slot]
+        frame.flags.writeable = False
+        return frame, seq, timestamp
+
+    def get_frame_at(self, timestamp):
+        #returns a copy of the buffered frame captured closest to the given monotonic timestamp
+        return self.get_frames_around(timestamp, 1)[0]
+
+    def get_frames_around(self, timestamp, count):
+        #copies of the count buffered frames closest to timestamp, in capture order, as (frame, seq, time)
+        if self._buffer is None:
+            raise ValueError("Camera capture thread is not running")
+        while True:
+            with self._lock:
+                writing_slot = (self._seq + 1) % self.buffer_size
+                valid = self._slot_seq >= 0
+                valid[writing_slot] = False
+                if not valid.any():
+                    raise ValueError("No frames captured yet")
+                offsets = np.abs(self._slot_time - timestamp)
+                offsets[~valid] = np.inf
+                slots = np.argsort(offsets, kind='stable')[:min(count, int(valid.sum()))]
+                slots = slots[np.argsort(self._slot_seq[slots])]
+                seqs = self._slot_seq[slots].copy()
+                capture_times = self._slot_time[slots].copy()
+
+            frames = [self._buffer[slot].copy() for slot in slots]
+
+            #retry if the capture thread overwrote a slot while it was being copied
+            with self._lock:
+                writing_slot = (self._seq + 1) % self.buffer_size
+                intact = (np.array_equal(self._slot_seq[slots], seqs)
+                          and writing_slot not in slots)
+            if intact:
+                return [(frame, int(seq), float(capture_time))
+                        for frame, seq, capture_time in zip(frames, seqs, capture_times)]
+
+    def get_frame(self):
+        if self.cap is None:
+            raise ValueError("Camera is not initialized")
+        if self.threaded:
+            if self._error is not None:
+                raise ValueError(self._error)
+            frame, _, _ = self.read_latest()
+            return frame
+        with CAPTURE_SECONDS.labels(self.device_id).time():
+            ret, frame = self.cap.read()
+        if not ret:
+            raise ValueError("Failed to capture frame")
+        FRAMES_CAPTURED.labels(self.device_id).inc()
         return frame
 
     def get_dimensions(self):
@@ -30,5 +167,9 @@ class Camera:
         return width, height
 
     def release(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+            self._thread = None
         if self.cap is not None:
-            self.cap.release()
\ No newline at end of file
+            self.cap.release()
@@ -0,0 +1,356 @@
+import os
+import threading
+import time
+import yaml
+from src.log import get_logger
+
+log = get_logger('config')
+
+ENV_PREFIX = 'SMART_SCALE__'
+
+#section -> key -> (accepted types, required)
+SCHEMA = {
+    'camera': {
+        'device_id': ((int, str), True),
+        'threaded': (bool, False),
+        'buffer_size': (int, False),
+        'history_mb': ((int, float), False),
+    },
+    'roi': {
+        'radius_fraction': ((int, float), True),
+        'mode': (str, False),
+    },
+    'mqtt': {
+        'broker': (str, True),
+        'port': (int, True),
+        'topic_weight': (str, True),
+        'topic_data': (str, True),
+        'topic_preview': (str, False),
+        'topic_tracking': (str, False),
+        'qos': (int, False),
+        'encoding': (str, False),
+        'batch_size': (int, False),
+        'batch_interval': ((int, float), False),
+        'spool_path': (str, False),
+    },
+    'mysql': {
+        'host': (str, True),
+        'user': (str, True),
+        'password': (str, False),
+        'database': (str, True),
+        'connect_timeout': ((int, float), False),
+        'driver': (str, False),
+        'sqlite_path': (str, False),
+        'pool_size': (int, False),
+        'batch_size': (int, False),
+        'flush_interval': ((int, float), False),
+        'retry_interval': ((int, float), False),
+        'spool_path': (str, False),
+        'device_id': (str, False),
+    },
+    'threshold': {
+        'weight': ((int, float), True),
+        'stable_readings': (int, False),
+        'stable_stddev': ((int, float), False),
+        'rearm_weight': ((int, float), False),
+    },
+    'yolo': {
+        'backend': (str, False),
+        'model_path': (str, True),
+        'imgsz': (int, False),
+        'threads': (int, False),
+        'conf_threshold': ((int, float), True),
+        'iou_threshold': ((int, float), True),
+        'classes': (list, True),
+    },
+    'inference': {
+        'workers': (int, False),
+        'queue_depth': (int, False),
+        'submit_timeout': ((int, float), False),
+        'max_batch': (int, False),
+        'vote_frames': (int, False),
+        'vote_method': (str, False),
+    },
+    'tracking': {
+        'enabled': (bool, False),
+        'low_conf': ((int, float), False),
+        'match_iou': ((int, float), False),
+        'max_age': (int, False),
+        'history': (int, False),
+        'max_tracks': (int, False),
+        'margin': ((int, float), False),
+    },
+    'motion': {
+        'enabled': (bool, False),
+        'width': (int, False),
+        'pixel_threshold': (int, False),
+        'min_area': ((int, float), False),
+        'max_interval': ((int, float), False),
+    },
+    'metrics': {
+        'port': (int, False),
+        'host': (str, False),
+    },
+    'logging': {
+        'level': (str, False),
+        'format': (str, False),
+        'rate_limit': (int, False),
+        'rate_interval': ((int, float), False),
+    },
+    'display': {
+        'headless': (bool, False),
+        'preview_fps': ((int, float), False),
+        'stream': (bool, False),
+        'scale': ((int, float), False),
+        'jpeg_quality': (int, False),
+    },
+    'output': {
+        'directory': (str, True),
+        'format': (str, False),
+        'quality': (int, False),
+        'max_width': (int, False),
+        'fsync': (bool, False),
+        'workers': (int, False),
+        'layout': (str, False),
+        'thumbnail_width': (int, False),
+        'max_size_mb': ((int, float), False),
+        'max_age_days': ((int, float), False),
+    },
+}
+
+#values that components read on every use, so they can change without a restart
+HOT_RELOAD_KEYS = [
+    ('threshold', 'weight'),
+    ('yolo', 'conf_threshold'),
+    ('roi', 'radius_fraction'),
+    ('display', 'preview_fps'),
+]
+
+#keys a station may not override, the model and the shared services are loaded once per process
+SHARED_SECTIONS = ('yolo', 'inference', 'mysql', 'output', 'metrics', 'logging')
+
+class ConfigError(ValueError):
+    pass
+
+def apply_env_overrides(data, environ=None):
+    #SMART_SCALE__YOLO__CONF_THRESHOLD=0.6 overrides data['yolo']['conf_threshold']
+    environ = os.environ if environ is None else environ
+    for name, raw in environ.items():
+        if not name.startswith(ENV_PREFIX):
+            continue
+        parts = name[len(ENV_PREFIX):].lower().split('__')
+        if len(parts) != 2:
+            raise ConfigError(f"Environment override {name} must look like {ENV_PREFIX}SECTION__KEY")
+        section, key = parts
+        data.setdefault(section, {})[key] = yaml.safe_load(raw)
+    return data
+
+def validate(data):
+    errors = []
+    for section, keys in SCHEMA.items():
+        values = data.get(section)
+        if values is None:
+            if any(required for _, required in keys.values()):
+                errors.append(f"missing section '{section}'")
+            else:
+                #a section left out is read as empty, its components fall back to their defaults
+                data[section] = {}
+            continue
+        if not isinstance(values, dict):
+            errors.append(f"section '{section}' must be a mapping")
+            continue
+        for key, (types, required) in keys.items():
+            if key not in values:
+                if required:
+                    errors.append(f"missing key '{section}.{key}'")
+                continue
+            value = values[key]
+            #bool is a subclass of int, do not let true/false pass as a number
+            if not isinstance(value, types) or (isinstance(value, bool) and types is not bool):
+                errors.append(f"'{section}.{key}' has invalid value {value!r}")
+
+    if not errors:
+        if not 0 < data['yolo']['conf_threshold'] < 1:
+            errors.append("'yolo.conf_threshold' must be between 0 and 1")
+        if not 0 < data['roi']['radius_fraction'] <= 0.5:
+            errors.append("'roi.radius_fraction' must be in (0, 0.5]")
+        if data['threshold'].get('stable_readings', 1) < 1 or data['threshold'].get('stable_stddev', 0.05) < 0:
+            errors.append("'threshold.stable_readings' must be at least 1 and 'threshold.stable_stddev' not negative")
+        if data['threshold'].get('rearm_weight', data['threshold']['weight']) > data['threshold']['weight']:
+            errors.append("'threshold.rearm_weight' must not be above 'threshold.weight'")
+        if data['inference'].get('vote_method', 'median') not in ('median', 'mode', 'confidence'):
+            errors.append("'inference.vote_method' must be 'median', 'mode' or 'confidence'")
+        if data['output'].get('layout', 'date') not in ('date', 'flat'):
+            errors.append("'output.layout' must be 'date' or 'flat'")
+        if data['output'].get('format', 'jpg') not in ('jpg', 'webp'):
+            errors.append("'output.format' must be 'jpg' or 'webp'")
+        if data['mqtt'].get('qos', 1) not in (0, 1, 2):
+            errors.append("'mqtt.qos' must be 0, 1 or 2")
+        if data['mqtt'].get('encoding', 'json') not in ('json', 'msgpack', 'cbor'):
+            errors.append("'mqtt.encoding' must be 'json', 'msgpack' or 'cbor'")
+        if (data.get('tracking') or {}).get('margin', 1.0) < 0:
+            errors.append("'tracking.margin' must not be negative")
+        if data['mqtt'].get('batch_size', 1) < 1:
+            errors.append("'mqtt.batch_size' must be at least 1")
+        logging_settings = data.get('logging') or {}
+        if str(logging_settings.get('level', 'INFO')).upper() not in ('DEBUG', 'INFO', 'WARNING', 'ERROR'):
+            errors.append("'logging.level' must be DEBUG, INFO, WARNING or ERROR")
+        if logging_settings.get('format', 'text') not in ('text', 'json'):
+            errors.append("'logging.format' must be 'text' or 'json'")
+        if data['mysql'].get('driver', 'mysql') not in ('mysql', 'sqlite'):
+            errors.append("'mysql.driver' must be 'mysql' or 'sqlite'")
+        if data['roi'].get('mode', 'mask') not in ('mask', 'crop'):
+            errors.append("'roi.mode' must be 'mask' or 'crop'")
+    if not errors and 'stations' in data:
+        errors.extend(validate_stations(data))
+    if errors:
+        raise ConfigError("Invalid configuration: " + "; ".join(errors))
+    return data
+
+def validate_stations(data):
+    #each station overrides whole keys of the top level sections, e.g. camera.device_id or threshold.weight
+    stations = data['stations']
+    if not isinstance(stations, list) or not stations:
+        return ["'stations' must be a non-empty list"]
+    errors = []
+    seen = set()
+    #one MQTT client serves every station, two stations on one weight topic would swallow each other's triggers
+    weight_topics = {}
+    for i, station in enumerate(stations):
+        if not isinstance(station, dict) or not isinstance(station.get('id'), str):
+            errors.append(f"station {i} must be a mapping with a string 'id'")
+            continue
+        if station['id'] in seen:
+            errors.append(f"station id '{station['id']}' is used twice")
+        seen.add(station['id'])
+        for section, values in station.items():
+            if section == 'id':
+                continue
+            if section not in SCHEMA or section in SHARED_SECTIONS or not isinstance(values, dict):
+                errors.append(f"station '{station['id']}' cannot override '{section}'")
+                continue
+            for key in values:
+                if key not in SCHEMA[section]:
+                    errors.append(f"station '{station['id']}' has unknown key '{section}.{key}'")
+        if errors:
+            continue
+        topic = station.get('mqtt', {}).get('topic_weight', data['mqtt']['topic_weight'])
+        if topic in weight_topics:
+            errors.append(f"stations '{weight_topics[topic]}' and '{station['id']}' share weight topic '{topic}'")
+            continue
+        weight_topics[topic] = station['id']
+        #the merged view must pass the same checks as a single-station config
+        merged = {section: dict(values) for section, values in data.items() if section != 'stations'}
+        for section, values in station.items():
+            if section != 'id':
+                merged.setdefault(section, {}).update(values)
+        try:
+            validate(merged)
+        except ConfigError as e:
+            errors.append(f"station '{station['id']}': {str(e).split(': ', 1)[1]}")
+    return errors
+
+class Config:
+    def __init__(self, path='config.yaml', check_interval=1.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._last_check = time.monotonic()
+        self._mtime = os.path.getmtime(path)
+        self._data = self._load()
+        #restart-only changes already warned about, so each is reported once rather than on every reload
+        self._pending_restart = {}
+
+    def _load(self):
+        with open(self.path, 'r') as file:
+            data = yaml.safe_load(file) or {}
+        return validate(apply_env_overrides(data))
+
+    def __getitem__(self, section):
+        return self._data[section]
+
+    def __contains__(self, section):
+        return section in self._data
+
+    def get(self, section, default=None):
+        return self._data.get(section, default)
+
+    def reload(self):
+        #applies hot-reloadable values in place and returns the keys that changed
+        try:
+            data = self._load()
+        except (OSError, yaml.YAMLError, ConfigError) as e:
+            log.warning("Config reload failed, keeping current values: %s", e)
+            return []
+
+        changed = []
+        with self._lock:
+            for section, key in HOT_RELOAD_KEYS:
+                #a key removed from the file goes back to its default
+                values, current = data[section], self._data[section]
+                if values.get(key) != current.get(key):
+                    if key in values:
+                        current[key] = values[key]
+                    else:
+                        del current[key]
+                    changed.append(f"{section}.{key}")
+            for section, values in data.items():
+                if not isinstance(values, dict):
+                    continue
+                for key, value in values.items():
+                    if (section, key) in HOT_RELOAD_KEYS:
+                        continue
+                    if self._data.get(section, {}).get(key) == value:
+                        #changed back to the running value, nothing is pending any more
+                        self._pending_restart.pop((section, key), None)
+                    elif (section, key) not in self._pending_restart or self._pending_restart[(section, key)] != value:
+                        self._pending_restart[(section, key)] = value
+                        log.warning("Config change to %s.%s needs a restart to take effect", section, key)
+            changed.extend(self._reload_stations(data))
+        for name in changed:
+            log.info("Config reloaded %s", name)
+        return changed
+
+    def _reload_stations(self, data):
+        #hot-reloadable keys overridden per station, stations cannot be added or removed while running
+        changed = []
+        current = {station['id']: station for station in self._data.get('stations', [])}
+        for station in data.get('stations', []):
+            if station['id'] not in current:
+                if self._pending_restart.get(('stations', station['id'])) is None:
+                    self._pending_restart[('stations', station['id'])] = True
+                    log.warning("Config change adding station %s needs a restart to take effect", station['id'])
+                continue
+            for section, key in HOT_RELOAD_KEYS:
+                if key not in station.get(section, {}):
+                    continue
+                values = current[station['id']].setdefault(section, {})
+                if values.get(key) != station[section][key]:
+                    values[key] = station[section][key]
+                    changed.append(f"stations.{station['id']}.{section}.{key}")
+        return changed
+
+    def reload_if_changed(self):
+        #cheap enough to call every loop iteration, the file is only stat'ed every check_interval
+        now = time.monotonic()
+        if now - self._last_check < self.check_interval:
+            return []
+        self._last_check = now
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return []
+        if mtime == self._mtime:
+            return []
+        self._mtime = mtime
+        return self.reload()
+
+_configs = {}
+_configs_lock = threading.Lock()
+
+def load_config(path='config.yaml'):
+    #every component asking for the same file shares one parsed Config
+    with _configs_lock:
+        if path not in _configs:
+            _configs[path] = Config(path)
+        return _configs[path]
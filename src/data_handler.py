@@ -1,20 +1,116 @@
+import itertools
 import os
+import time
 import cv2
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime
-import yaml
+from src.config import load_config
+from src.log import get_logger
+from src.metrics import counter, gauge, histogram
+from src.storage import RetentionManager, shard_directory, thumbnail_path
+
+log = get_logger('data_handler')
+SAVE_SECONDS = histogram('smart_scale_image_save_seconds', 'Time to encode and write one image and its thumbnail')
+IMAGES_SAVED = counter('smart_scale_images_saved_total', 'Images written to disk')
+IMAGE_SAVE_FAILURES = counter('smart_scale_image_save_failures_total', 'Images that could not be written')
+SAVE_QUEUE = gauge('smart_scale_image_save_queue', 'Images waiting for the background writer')
 
 class DataHandler:
-    def __init__(self, config_path='config.yaml'):
-        with open(config_path, 'r') as file:
-            config = yaml.safe_load(file)
-        
+    def __init__(self, config=None):
+        if config is None:
+            config = load_config()
+        self.config = config
+
         self.output_dir = config['output']['directory']
+        self.format = config['output'].get('format', 'jpg')
+        self.quality = config['output'].get('quality', 90)
+        self.max_width = config['output'].get('max_width', 0)
+        self.fsync = config['output'].get('fsync', False)
+        self.layout = config['output'].get('layout', 'date')
+        self.thumbnail_width = config['output'].get('thumbnail_width', 320)
         os.makedirs(self.output_dir, exist_ok=True)
 
-    def save_frame(self, frame, count, weight):
-        timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-        filename = f"{self.output_dir}/chicken_count_{count:02d}_date_{timestamp}_weight_{weight:.2f}.jpg"
-        
-        cv2.imwrite(filename, frame)
-        print(f"Frame saved: {filename}")
-        return filename
\ No newline at end of file
+        self.retention = RetentionManager(self.output_dir,
+                                          config['output'].get('max_size_mb', 0),
+                                          config['output'].get('max_age_days', 0))
+        self.retention.start()
+
+        #encoding and disk writes run off the detection loop, cv2 releases the GIL while encoding
+        self.executor = ThreadPoolExecutor(max_workers=config['output'].get('workers', 1),
+                                           thread_name_prefix="image-save")
+        self.pending = set()
+        self._sequence = itertools.count()
+
+    def encode_params(self):
+        if self.format == 'webp':
+            return [cv2.IMWRITE_WEBP_QUALITY, self.quality]
+        return [cv2.IMWRITE_JPEG_QUALITY, self.quality]
+
+    def save_frame(self, frame, count, weight, copy=True, station_id=None):
+        #returns the final path right away, the file appears there once the background write finishes
+        now = datetime.now()
+        timestamp = now.strftime("%Y-%m-%d_%H-%M-%S-%f")
+        sequence = next(self._sequence)
+        #stations sharing one process each get their own directory
+        output_dir = os.path.join(self.output_dir, station_id) if station_id else self.output_dir
+        #one directory per day keeps directory listings short on the SD card
+        directory = shard_directory(output_dir, now) if self.layout == 'date' else output_dir
+        filename = f"{directory}/chicken_count_{count:02d}_date_{timestamp}_{sequence:04d}_weight_{weight:.2f}.{self.format}"
+
+        #callers that keep drawing into frame must not race the writer
+        if copy:
+            frame = frame.copy()
+        future = self.executor.submit(self._write, frame, filename)
+        self.pending.add(future)
+        future.add_done_callback(self.pending.discard)
+        return filename
+
+    def _resize(self, frame, max_width):
+        height, width = frame.shape[:2]
+        if max_width and width > max_width:
+            size = (max_width, int(height * max_width / width))
+            frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+        return frame
+
+    def _write_file(self, frame, filename):
+        ok, encoded = cv2.imencode(f".{self.format}", frame, self.encode_params())
+        if not ok:
+            raise ValueError(f"Could not encode frame as {self.format}")
+
+        #write to a temporary name first so readers never see a partial image
+        temp_filename = filename + ".tmp"
+        with open(temp_filename, 'wb') as file:
+            file.write(encoded.tobytes())
+            if self.fsync:
+                file.flush()
+                os.fsync(file.fileno())
+        os.replace(temp_filename, filename)
+        return len(encoded)
+
+    def _write(self, frame, filename):
+        start = time.perf_counter()
+        try:
+            directory = os.path.dirname(filename)
+            os.makedirs(directory, exist_ok=True)
+            size = self._write_file(self._resize(frame, self.max_width), filename)
+            if self.thumbnail_width:
+                size += self._write_file(self._resize(frame, self.thumbnail_width), thumbnail_path(filename))
+            if self.fsync:
+                fd = os.open(directory or '.', os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            self.retention.add(filename, size)
+            SAVE_SECONDS.observe(time.perf_counter() - start)
+            IMAGES_SAVED.inc()
+            log.info("Frame saved: %s", filename)
+        except Exception as e:
+            IMAGE_SAVE_FAILURES.inc()
+            log.error("Failed to save frame %s: %s", filename, e)
+
+    def flush(self, timeout=None):
+        wait(list(self.pending), timeout=timeout)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
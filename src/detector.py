@@ -1,26 +1,232 @@
-from ultralytics import YOLO
-import yaml
+import numpy as np
+from src.config import load_config
+from src.inference_backends import create_backend
 
 class Detector:
-    def __init__(self, config_path='config.yaml'):
-        with open(config_path, 'r') as file:
-            config = yaml.safe_load(file)
+    def __init__(self, config=None):
+        if config is None:
+            config = load_config()
+        self.config = config
         
+        self.backend_name = config['yolo'].get('backend', 'ultralytics')
         self.model_path = config['yolo']['model_path']
-        self.conf_threshold = config['yolo']['conf_threshold']
+        self.imgsz = config['yolo'].get('imgsz', 640)
+        self.threads = config['yolo'].get('threads', 4)
         self.iou_threshold = config['yolo']['iou_threshold']
         self.classes = config['yolo']['classes']
+        self.vote_method = config['inference'].get('vote_method', 'median')
 
-        self.model = YOLO(self.model_path)
+        self.backend = create_backend(self.backend_name, self.model_path, self.imgsz, self.threads)
+
+    @property
+    def conf_threshold(self):
+        #hot-reloadable, the model itself does not need to be reloaded
+        return self.config['yolo']['conf_threshold']
 
     def detect(self, frame):
-        results = self.model.predict(
-            source=frame,
-            conf=self.conf_threshold,
-            iou=self.iou_threshold,
+        return self.detect_batch([frame])
+
+    def detect_batch(self, frames, conf_threshold=None):
+        #one predict call for all frames, returns one Results per frame
+        results = self.backend.predict(
+            frames,
+            conf_threshold=self.conf_threshold if conf_threshold is None else conf_threshold,
+            iou_threshold=self.iou_threshold,
             classes=self.classes
         )
         return results
 
+    def warmup(self):
+        #one dummy inference at the configured size so the first real trigger is not slowed by lazy init
+        self.detect(np.zeros((self.imgsz, self.imgsz, 3), dtype=np.uint8))
+
     def count_chickens(self, results):
-        return len(results[0].boxes)
\ No newline at end of file
+        return len(results[0].boxes)
+
+    def vote_count(self, results, reference_index=0):
+        #combines per-frame counts into one count and returns it with the index of the frame that best shows it
+        counts = np.array([len(result.boxes) for result in results])
+        if self.vote_method == 'mode':
+            values, occurrences = np.unique(counts, return_counts=True)
+            tied = values[occurrences == occurrences.max()]
+            #on a tie prefer the value closest to the median
+            count = int(tied[np.argmin(np.abs(tied - np.median(counts)))])
+        elif self.vote_method == 'confidence':
+            #frames are weighted by their mean box confidence, an empty frame counts as a zero at threshold confidence
+            weights = np.array([result.boxes.conf.mean() if len(result.boxes) else self.conf_threshold
+                                for result in results], dtype=np.float64)
+            count = int(np.floor(np.average(counts, weights=weights) + 0.5))
+        elif self.vote_method == 'median':
+            count = int(np.floor(np.median(counts) + 0.5))
+        else:
+            raise ValueError(f"Unknown vote method '{self.vote_method}'")
+
+        #among frames closest to the voted count, pick the one nearest the reference (trigger) frame
+        distance = np.abs(counts - count) * len(counts) + np.abs(np.arange(len(counts)) - reference_index)
+        return count, int(np.argmin(distance))
+
+    @property
+    def track_conf(self):
+        #tracking keeps weak detections so a briefly occluded bird keeps its track
+        return (self.config.get('tracking') or {}).get('low_conf', 0.1)
+
+def box_iou(a, b):
+    #(N, 4) x (M, 4) xyxy boxes -> (N, M) IoU, computed for all pairs at once
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / (area_a[:, None] + area_b[None, :] - inter + 1e-7)
+
+def match_boxes(tracks, detections, iou_threshold):
+    #greedy matching on the IoU matrix, highest overlap first, returns (track, detection) index pairs
+    if len(tracks) == 0 or len(detections) == 0:
+        return []
+    iou = box_iou(tracks, detections)
+    pairs = np.argwhere(iou >= iou_threshold)
+    pairs = pairs[np.argsort(-iou[pairs[:, 0], pairs[:, 1]], kind='stable')]
+    used_tracks, used_detections, matches = set(), set(), []
+    for track, detection in pairs:
+        if track in used_tracks or detection in used_detections:
+            continue
+        used_tracks.add(track)
+        used_detections.add(detection)
+        matches.append((track, detection))
+    return matches
+
+class Tracker:
+    #ByteTrack-style association of detections across frames, counting birds that cross the ROI circle.
+    #tracks live in fixed-size arrays, one row per slot, so a long loading session never grows memory
+    def __init__(self, center, radius, config=None):
+        if config is None:
+            config = load_config()
+        self.config = config
+
+        tracking = config.get('tracking') or {}
+        self.low_conf = tracking.get('low_conf', 0.1)
+        self.match_iou = tracking.get('match_iou', 0.3)
+        self.max_age = tracking.get('max_age', 30)
+        self.history_size = tracking.get('history', 30)
+        self.capacity = tracking.get('max_tracks', 128)
+
+        self.boxes = np.zeros((self.capacity, 4), dtype=np.float32)
+        self.velocity = np.zeros((self.capacity, 4), dtype=np.float32)
+        self.ids = np.full(self.capacity, -1, dtype=np.int64)
+        self.missed = np.zeros(self.capacity, dtype=np.int32)
+        self.active = np.zeros(self.capacity, dtype=bool)
+        self.inside = np.zeros(self.capacity, dtype=bool)
+        #set once a track has been inside the circle, so a bird that steps out and back is counted once
+        self.counted = np.zeros(self.capacity, dtype=bool)
+        #ring of the last history_size box centers per track, history_count is the number ever written
+        self.history = np.zeros((self.capacity, self.history_size, 2), dtype=np.float32)
+        self.history_count = np.zeros(self.capacity, dtype=np.int64)
+
+        self.next_id = 1
+        self.entered = 0
+        self.left = 0
+        self.unique = 0
+        self.set_roi(center, radius)
+
+    @property
+    def high_conf(self):
+        #detections the count path would accept start tracks, weaker ones only keep existing tracks alive
+        return self.config['yolo']['conf_threshold']
+
+    def set_roi(self, center, radius):
+        self.center = np.array(center, dtype=np.float32)
+        self.radius = radius
+
+    def _is_inside(self, boxes):
+        centers = (boxes[:, :2] + boxes[:, 2:4]) / 2
+        return np.linalg.norm(centers - self.center, axis=1) <= self.radius
+
+    def _record(self, slots, boxes):
+        centers = (boxes[:, :2] + boxes[:, 2:4]) / 2
+        self.history[slots, self.history_count[slots] % self.history_size] = centers
+        self.history_count[slots] += 1
+
+    def update(self, results):
+        #results is one Results for the newest frame, returns the current counts
+        boxes, conf = results.boxes.xyxy, results.boxes.conf
+        high = np.flatnonzero(conf >= self.high_conf)
+        low = np.flatnonzero((conf < self.high_conf) & (conf >= self.low_conf))
+
+        #constant velocity prediction of where each track is now
+        slots = np.flatnonzero(self.active)
+        predicted = self.boxes[slots] + self.velocity[slots]
+
+        #confident detections first, then the leftover tracks get a chance at the weak ones
+        matches = [(slots[t], high[d]) for t, d in match_boxes(predicted, boxes[high], self.match_iou)]
+        matched_slots = {slot for slot, _ in matches}
+        remaining = np.array([i for i, slot in enumerate(slots) if slot not in matched_slots], dtype=np.int64)
+        if len(remaining):
+            matches += [(slots[remaining[t]], low[d])
+                        for t, d in match_boxes(predicted[remaining], boxes[low], self.match_iou)]
+
+        if matches:
+            matched, detections = (np.array(column, dtype=np.int64) for column in zip(*matches))
+            new_boxes = boxes[detections]
+            self.velocity[matched] = 0.5 * self.velocity[matched] + 0.5 * (new_boxes - self.boxes[matched])
+            self.boxes[matched] = new_boxes
+            self.missed[matched] = 0
+            self._record(matched, new_boxes)
+            inside = self._is_inside(new_boxes)
+            was_inside = self.inside[matched]
+            self.entered += int(np.count_nonzero(inside & ~was_inside))
+            self.left += int(np.count_nonzero(~inside & was_inside))
+            self.inside[matched] = inside
+            self.unique += int(np.count_nonzero(inside & ~self.counted[matched]))
+            self.counted[matched] |= inside
+        else:
+            matched, detections = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+        #unmatched tracks coast on their prediction until they have been missing for max_age frames
+        lost = np.setdiff1d(slots, matched)
+        self.boxes[lost] += self.velocity[lost]
+        self.missed[lost] += 1
+        self.active[lost[self.missed[lost] > self.max_age]] = False
+
+        self._start_tracks(boxes[np.setdiff1d(high, detections)])
+        return self.counts()
+
+    def _start_tracks(self, boxes):
+        free = np.flatnonzero(~self.active)
+        if len(boxes) > len(free):
+            #out of slots, the longest missing tracks make room
+            oldest = np.argsort(-self.missed * self.active)[:len(boxes) - len(free)]
+            self.active[oldest] = False
+            free = np.flatnonzero(~self.active)
+        slots = free[:len(boxes)]
+        self.boxes[slots] = boxes
+        self.velocity[slots] = 0
+        self.ids[slots] = np.arange(self.next_id, self.next_id + len(slots))
+        self.next_id += len(slots)
+        self.missed[slots] = 0
+        self.active[slots] = True
+        self.history_count[slots] = 0
+        self._record(slots, boxes)
+        #a bird first seen inside the circle was placed there, it is counted but did not cross
+        self.inside[slots] = self._is_inside(boxes)
+        self.counted[slots] = self.inside[slots]
+        self.unique += int(np.count_nonzero(self.inside[slots]))
+
+    def counts(self):
+        visible = self.active & (self.missed == 0)
+        return {
+            'inside': int(np.count_nonzero(visible & self.inside)),
+            'entered': self.entered,
+            'left': self.left,
+            'unique': self.unique,
+        }
+
+    def tracks(self):
+        #(id, box, centers oldest first) for every track seen in the newest frame
+        tracks = []
+        for slot in np.flatnonzero(self.active & (self.missed == 0)):
+            count = self.history_count[slot]
+            order = np.arange(max(0, count - self.history_size), count) % self.history_size
+            tracks.append((int(self.ids[slot]), self.boxes[slot].copy(), self.history[slot, order].copy()))
+        return tracks
@@ -0,0 +1,133 @@
+import asyncio
+import json
+import time
+from collections import deque
+from datetime import date
+from src.log import get_logger
+from src.metrics import counter
+
+log = get_logger('fanout')
+CLIENTS_DROPPED = counter('smart_scale_websocket_clients_dropped_total', 'Websocket clients disconnected by the server', ['reason'])
+
+class Client:
+    #one websocket with its own bounded send queue and sender task
+    def __init__(self, ws, queue_size):
+        self.ws = ws
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.task = None
+
+    async def run(self):
+        while True:
+            message = await self.queue.get()
+            await self.ws.send(message)
+
+class FanOut:
+    #broadcasts each message to every client without letting a slow client hold up the others
+    def __init__(self, queue_size=32):
+        self.queue_size = queue_size
+        self.clients = {}
+
+    def add(self, ws, initial=()):
+        #initial messages are queued before the client sees any live message, so nothing is missed in between
+        initial = list(initial)
+        client = Client(ws, self.queue_size + len(initial))
+        for message in initial:
+            client.queue.put_nowait(message)
+        client.task = asyncio.ensure_future(client.run())
+        client.task.add_done_callback(lambda _: self._drop(ws, "sender stopped"))
+        self.clients[ws] = client
+        return client
+
+    def remove(self, ws):
+        client = self.clients.pop(ws, None)
+        if client is not None and not client.task.done():
+            client.task.cancel()
+
+    def publish(self, message):
+        #message is serialized once by the caller and shared by all clients
+        for ws, client in list(self.clients.items()):
+            try:
+                client.queue.put_nowait(message)
+            except asyncio.QueueFull:
+                self._drop(ws, "too slow")
+
+    def _drop(self, ws, reason):
+        if ws not in self.clients:
+            return
+        log.info("Dropping websocket client: %s", reason)
+        CLIENTS_DROPPED.labels(reason).inc()
+        self.remove(ws)
+        asyncio.ensure_future(self._close(ws))
+
+    async def _close(self, ws):
+        try:
+            await ws.close()
+        except Exception:
+            pass
+
+    def __len__(self):
+        return len(self.clients)
+
+class ReplayBuffer:
+    #the last N published messages plus today's running totals, sent to clients as they connect
+    def __init__(self, size=100, epoch=None):
+        self.messages = deque(maxlen=size)
+        #seq restarts at 1 with every process, a resume point is only valid together with the epoch it came from
+        self.epoch = epoch if epoch is not None else int(time.time() * 1000)
+        self.seq = 0
+        self.day = None
+        self.totals = {'events': 0, 'total_count': 0, 'total_weight': 0.0}
+
+    def seed(self, day, rows):
+        #starts the day from rows of detection_daily, so a restart does not reset the totals to zero
+        self.day = str(day)
+        self.totals = {'events': 0, 'total_count': 0, 'total_weight': 0.0}
+        for row in rows:
+            for key in self.totals:
+                self.totals[key] += row[key]
+
+    def add(self, data):
+        #stamps data with the next sequence number and returns it serialized
+        self.seq += 1
+        data['seq'] = self.seq
+        data['epoch'] = self.epoch
+        self._update_totals(data)
+        message = json.dumps(data)
+        self.messages.append((self.seq, message))
+        return message
+
+    def _roll_over(self, day):
+        if self.day is None or day > self.day:
+            self.day = day
+            self.totals = {'events': 0, 'total_count': 0, 'total_weight': 0.0}
+
+    def _update_totals(self, data):
+        day = str(data.get('datetime') or date.today())[:10]
+        self._roll_over(day)
+        if day != self.day:
+            # A late event from an earlier day is not part of today's totals
+            return
+        self.totals['events'] += 1
+        self.totals['total_count'] += data.get('total_count') or 0
+        self.totals['total_weight'] += data.get('total_weight') or 0.0
+
+    def snapshot(self, since=None, epoch=None):
+        #a snapshot message followed by every buffered message newer than since
+        #the day is checked here too, a quiet night must not carry yesterday's totals into today
+        self._roll_over(date.today().isoformat())
+        if since is None or epoch != self.epoch or since > self.seq:
+            # No resume point, or it was handed out by an earlier run of the server
+            since = 0
+        oldest = self.messages[0][0] if self.messages else self.seq + 1
+        totals = dict(self.totals)
+        totals['average_weight'] = totals['total_weight'] / totals['total_count'] if totals['total_count'] else 0
+        snapshot = {
+            'type': 'snapshot',
+            'epoch': self.epoch,
+            'seq': self.seq,
+            'date': self.day,
+            'totals': totals,
+            # False when messages after since were already pushed out of the buffer
+            'complete': since >= oldest - 1,
+        }
+        return [json.dumps(snapshot)] + [message for seq, message in self.messages if seq > since]
@@ -0,0 +1,120 @@
+import mimetypes
+import os
+import threading
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+import cv2
+import numpy as np
+
+#widths that may be requested with ?w=, other values round up to the next one so the cache stays small
+VARIANT_WIDTHS = (160, 320, 640, 1280)
+
+def variant_width(requested):
+    #None means the original image
+    try:
+        requested = int(requested)
+    except (TypeError, ValueError):
+        return None
+    if requested <= 0:
+        return None
+    for width in VARIANT_WIDTHS:
+        if requested <= width:
+            return width
+    return None
+
+def parse_range(header, size):
+    #a single "bytes=start-end" range as (start, end) inclusive, None for no usable range, ValueError if unsatisfiable
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start, _, end = header[len("bytes="):].strip().partition("-")
+    try:
+        if start:
+            start = int(start)
+            end = int(end) if end else size - 1
+        else:
+            #"bytes=-N" is the last N bytes
+            start = max(size - int(end), 0)
+            end = size - 1
+    except ValueError:
+        return None
+    if start >= size or start > end:
+        raise ValueError(f"Range {header} not satisfiable for {size} bytes")
+    return start, min(end, size - 1)
+
+class CachedImage:
+    def __init__(self, body, content_type, etag, last_modified, mtime):
+        self.body = body
+        self.content_type = content_type
+        self.etag = etag
+        self.last_modified = last_modified
+        self.mtime = mtime
+
+    def not_modified(self, if_none_match, if_modified_since):
+        #If-None-Match wins over If-Modified-Since when both are sent
+        if if_none_match:
+            return self.etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*"
+        if if_modified_since:
+            try:
+                return int(self.mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+class ImageCache:
+    #least recently used images and resized variants held in memory, up to max_bytes in total
+    def __init__(self, max_bytes=32 * 1024 * 1024, quality=85):
+        self.max_bytes = max_bytes
+        self.quality = quality
+        self._items = OrderedDict()
+        self._total = 0
+        self._lock = threading.Lock()
+
+    def get(self, path, width=None):
+        #reads from disk on a miss, call it from an executor so the event loop never waits on the SD card
+        stat = os.stat(path)
+        key = (path, width)
+        with self._lock:
+            item = self._items.get(key)
+            #saved images are never rewritten, the mtime check only guards against a file replaced by hand
+            if item is not None and item.mtime == stat.st_mtime:
+                self._items.move_to_end(key)
+                return item
+        item = self._load(path, width, stat)
+        with self._lock:
+            self._put(key, item)
+        return item
+
+    def _load(self, path, width, stat):
+        with open(path, 'rb') as file:
+            body = file.read()
+        if width is not None:
+            body = self._resize(path, body, width)
+        content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}-{width or 0}"'
+        return CachedImage(body, content_type, etag, formatdate(stat.st_mtime, usegmt=True), stat.st_mtime)
+
+    def _resize(self, path, body, width):
+        frame = cv2.imdecode(np.frombuffer(body, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if frame is None or frame.shape[1] <= width:
+            return body
+        height = int(frame.shape[0] * width / frame.shape[1])
+        frame = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+        ext = os.path.splitext(path)[1].lower()
+        params = [cv2.IMWRITE_WEBP_QUALITY, self.quality] if ext == ".webp" else [cv2.IMWRITE_JPEG_QUALITY, self.quality]
+        ok, encoded = cv2.imencode(ext, frame, params)
+        return encoded.tobytes() if ok else body
+
+    def _put(self, key, item):
+        old = self._items.pop(key, None)
+        if old is not None:
+            self._total -= len(old.body)
+        if len(item.body) > self.max_bytes:
+            return
+        self._items[key] = item
+        self._total += len(item.body)
+        while self._total > self.max_bytes:
+            _, evicted = self._items.popitem(last=False)
+            self._total -= len(evicted.body)
+
+    def __len__(self):
+        return len(self._items)
@@ -1,35 +1,84 @@
 import cv2
 import numpy as np
-import yaml
+from src.config import load_config
 
 class ImageProcessor:
-    def __init__(self, config_path='config.yaml'):
-        with open(config_path, 'r') as file:
-            config = yaml.safe_load(file)
-        
-        self.radius_fraction = config['roi']['radius_fraction']
+    def __init__(self, config=None):
+        if config is None:
+            config = load_config()
+        self.config = config
+
+        self.mask_cache_size = 8
+        self._mask_cache = {}
+        self._buffers = {}
+
+    @property
+    def radius_fraction(self):
+        return self.config['roi']['radius_fraction']
+
+    @property
+    def roi_mode(self):
+        return self.config['roi'].get('mode', 'mask')
 
     def create_circular_mask(self, frame_shape, center, radius):
-        #this method create a mask from frame to be processed
-        Y, X = np.ogrid[:frame_shape[0], :frame_shape[1]]
-        dist_from_center = np.sqrt((X - center[0])**2 + (Y - center[1])**2)
-        mask = dist_from_center <= radius
+        #this method create a mask from frame to be processed, cached per shape, center and radius
+        key = (tuple(frame_shape[:2]), tuple(center), radius)
+        mask = self._mask_cache.get(key)
+        if mask is None:
+            mask = np.zeros(frame_shape[:2], dtype=np.uint8)
+            cv2.circle(mask, tuple(center), radius, 255, -1)
+            if len(self._mask_cache) >= self.mask_cache_size:
+                self._mask_cache.pop(next(iter(self._mask_cache)))
+            self._mask_cache[key] = mask
         return mask
 
-    def draw_roi(self, frame, center, radius):
+    def get_buffer(self, name, shape, dtype=np.uint8):
+        #reusable output buffer, the caller owns it until it asks for the same name again
+        shape = tuple(shape)
+        buffer = self._buffers.get(name)
+        if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+            buffer = np.empty(shape, dtype=dtype)
+            self._buffers[name] = buffer
+        return buffer
+
+    def draw_roi(self, frame, center, radius, out=None):
         #this method display the original frame with ROI
-        frame_with_roi = frame.copy()
+        if out is None:
+            frame_with_roi = frame.copy()
+        else:
+            frame_with_roi = out
+            np.copyto(frame_with_roi, frame)
         cv2.circle(frame_with_roi, center, radius, (0, 255, 0), 2)
         return frame_with_roi
 
-    def get_roi(self, frame, mask):
-        #circle frame
-        roi = frame.copy()
-        roi[~mask] = 0
-        return roi
+    def get_roi(self, frame, mask, out=None):
+        #circle frame, written into out when given so no new frame is allocated
+        return cv2.bitwise_and(frame, frame, dst=out, mask=mask)
+
+    def get_roi_crop(self, frame, mask, center, radius, out=None):
+        #crop the bounding square of the circle so the model input is not mostly black,
+        #the same slice of the frame mask keeps exactly the pixels get_roi would
+        height, width = frame.shape[:2]
+        x0, y0 = max(0, center[0] - radius), max(0, center[1] - radius)
+        x1, y1 = min(width, center[0] + radius + 1), min(height, center[1] + radius + 1)
+        crop = frame[y0:y1, x0:x1]
+        return cv2.bitwise_and(crop, crop, dst=out, mask=mask[y0:y1, x0:x1]), (x0, y0)
 
-    def draw_results(self, frame, count, results):
-        result_frame = frame.copy()
+    def get_crop(self, frame, center, half_size):
+        #unmasked square around center clipped to the frame, copied so it can outlive the camera buffer
+        height, width = frame.shape[:2]
+        x0, y0 = max(0, center[0] - half_size), max(0, center[1] - half_size)
+        x1, y1 = min(width, center[0] + half_size + 1), min(height, center[1] + half_size + 1)
+        return frame[y0:y1, x0:x1].copy(), (x0, y0)
+
+    def draw_results(self, frame, count, results, out=None):
+        #pass out=frame to draw in place
+        if out is None:
+            result_frame = frame.copy()
+        else:
+            result_frame = out
+            if out is not frame:
+                np.copyto(result_frame, frame)
         cv2.putText(result_frame, f"Chicken Count: {count}", (10, 30),
                     cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
         
@@ -41,6 +90,17 @@ class ImageProcessor:
         
         return result_frame
 
+    def draw_tracks(self, frame, tracks, counts):
+        #draws in place, each track as its recent path ending in its id
+        for track_id, _, centers in tracks:
+            points = centers.astype(np.int32).reshape((-1, 1, 2))
+            cv2.polylines(frame, [points], False, (255, 200, 0), 2)
+            x, y = points[-1, 0]
+            cv2.putText(frame, str(track_id), (int(x) + 6, int(y) - 6), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 200, 0), 1)
+        cv2.putText(frame, f"In: {counts['entered']} Out: {counts['left']} Inside: {counts['inside']}", (10, 60),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 200, 0), 2)
+        return frame
+
     def get_roi_params(self, frame_width, frame_height):
         center = (frame_width // 2, frame_height // 2)
         radius = int(min(frame_width, frame_height) * self.radius_fraction)
@@ -0,0 +1,212 @@
+import os
+import cv2
+import numpy as np
+
+class Boxes:
+    #same attribute names as ultralytics Boxes, backed by an (N, 6) array of x1, y1, x2, y2, conf, cls
+    def __init__(self, data):
+        self.data = data
+
+    @property
+    def xyxy(self):
+        return self.data[:, :4]
+
+    @property
+    def conf(self):
+        return self.data[:, 4]
+
+    @property
+    def cls(self):
+        return self.data[:, 5]
+
+    def __len__(self):
+        return len(self.data)
+
+class Results:
+    def __init__(self, boxes, orig_shape):
+        self.boxes = boxes
+        self.orig_shape = orig_shape
+
+    def translate(self, dx, dy):
+        #maps boxes from a crop back into the coordinates of the frame it was cut from
+        self.boxes.data[:, [0, 2]] += dx
+        self.boxes.data[:, [1, 3]] += dy
+        return self
+
+    def filter(self, keep):
+        return Results(Boxes(self.boxes.data[keep]), self.orig_shape)
+
+def letterbox(frame, imgsz, color=(114, 114, 114)):
+    #resize keeping the aspect ratio and pad to imgsz x imgsz, like ultralytics does
+    height, width = frame.shape[:2]
+    ratio = min(imgsz / height, imgsz / width)
+    new_width, new_height = int(round(width * ratio)), int(round(height * ratio))
+    pad_x = (imgsz - new_width) / 2
+    pad_y = (imgsz - new_height) / 2
+
+    if (new_width, new_height) != (width, height):
+        frame = cv2.resize(frame, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
+    top, bottom = int(round(pad_y - 0.1)), int(round(pad_y + 0.1))
+    left, right = int(round(pad_x - 0.1)), int(round(pad_x + 0.1))
+    padded = cv2.copyMakeBorder(frame, top, bottom, left, right, cv2.BORDER_CONSTANT, value=color)
+    return padded, ratio, (left, top)
+
+def preprocess(frame, imgsz):
+    padded, ratio, pad = letterbox(frame, imgsz)
+    #BGR HWC uint8 -> RGB CHW float32 in [0, 1]
+    blob = cv2.dnn.blobFromImage(padded, scalefactor=1 / 255.0, swapRB=True)
+    return blob, ratio, pad
+
+def non_max_suppression(boxes, scores, iou_threshold):
+    #greedy NMS with the IoU of each kept box against all remaining boxes computed at once
+    x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    areas = (x2 - x1) * (y2 - y1)
+    order = scores.argsort()[::-1]
+    keep = []
+    while order.size > 0:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        w = np.clip(np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest]), 0, None)
+        h = np.clip(np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest]), 0, None)
+        inter = w * h
+        iou = inter / (areas[i] + areas[rest] - inter + 1e-7)
+        order = rest[iou <= iou_threshold]
+    return np.array(keep, dtype=np.int64)
+
+def postprocess(output, orig_shape, ratio, pad, conf_threshold, iou_threshold, classes=None, max_det=300):
+    #decodes a raw YOLOv8 head of shape (4 + num_classes, num_anchors) into frame coordinates
+    predictions = output.T
+    class_scores = predictions[:, 4:]
+    class_ids = class_scores.argmax(axis=1)
+    scores = class_scores[np.arange(len(class_scores)), class_ids]
+
+    keep = scores > conf_threshold
+    if classes is not None:
+        keep &= np.isin(class_ids, classes)
+    predictions, class_ids, scores = predictions[keep], class_ids[keep], scores[keep]
+    if len(scores) == 0:
+        return Results(Boxes(np.zeros((0, 6), dtype=np.float32)), orig_shape)
+
+    cx, cy, w, h = predictions[:, 0], predictions[:, 1], predictions[:, 2], predictions[:, 3]
+    boxes = np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1)
+
+    #offset boxes per class so a single NMS pass never suppresses across classes
+    offsets = class_ids[:, None].astype(np.float32) * 7680
+    keep = non_max_suppression(boxes + offsets, scores, iou_threshold)[:max_det]
+    boxes, scores, class_ids = boxes[keep], scores[keep], class_ids[keep]
+
+    boxes[:, [0, 2]] = (boxes[:, [0, 2]] - pad[0]) / ratio
+    boxes[:, [1, 3]] = (boxes[:, [1, 3]] - pad[1]) / ratio
+    boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, orig_shape[1])
+    boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, orig_shape[0])
+
+    data = np.concatenate([boxes, scores[:, None], class_ids[:, None]], axis=1).astype(np.float32)
+    return Results(Boxes(data), orig_shape)
+
+class Backend:
+    def __init__(self, model_path, imgsz, threads):
+        self.model_path = model_path
+        self.imgsz = imgsz
+        self.threads = threads
+
+    def forward(self, blob):
+        raise NotImplementedError
+
+    def forward_batch(self, blobs):
+        #engines exported with a fixed batch of 1 run the frames one after another
+        return [self.forward(blob) for blob in blobs]
+
+    def predict(self, frames, conf_threshold, iou_threshold, classes=None):
+        prepared = [preprocess(frame, self.imgsz) for frame in frames]
+        outputs = self.forward_batch([blob for blob, _, _ in prepared])
+        results = []
+        for frame, (_, ratio, pad), output in zip(frames, prepared, outputs):
+            results.append(postprocess(output, frame.shape[:2], ratio, pad,
+                                       conf_threshold, iou_threshold, classes))
+        return results
+
+class UltralyticsBackend(Backend):
+    def __init__(self, model_path, imgsz, threads):
+        super().__init__(model_path, imgsz, threads)
+        from ultralytics import YOLO
+        self.model = YOLO(model_path)
+
+    def predict(self, frames, conf_threshold, iou_threshold, classes=None):
+        predictions = self.model.predict(
+            source=frames,
+            imgsz=self.imgsz,
+            conf=conf_threshold,
+            iou=iou_threshold,
+            classes=classes,
+            verbose=False
+        )
+        results = []
+        for prediction in predictions:
+            data = prediction.boxes.data.cpu().numpy().astype(np.float32)
+            results.append(Results(Boxes(data), prediction.orig_shape))
+        return results
+
+class NCNNBackend(Backend):
+    def __init__(self, model_path, imgsz, threads):
+        super().__init__(model_path, imgsz, threads)
+        import ncnn
+        self.ncnn = ncnn
+        self.net = ncnn.Net()
+        self.net.opt.num_threads = threads
+        self.net.load_param(os.path.join(model_path, "model.ncnn.param"))
+        self.net.load_model(os.path.join(model_path, "model.ncnn.bin"))
+
+    def forward(self, blob):
+        with self.net.create_extractor() as ex:
+            ex.input("in0", self.ncnn.Mat(blob[0]))
+            _, out0 = ex.extract("out0")
+        return np.array(out0)
+
+class ONNXBackend(Backend):
+    def __init__(self, model_path, imgsz, threads):
+        super().__init__(model_path, imgsz, threads)
+        import onnxruntime
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        #a symbolic batch dimension means the export accepts several frames in one run
+        self.dynamic_batch = not isinstance(model_input.shape[0], int)
+
+    def forward(self, blob):
+        return self.session.run(None, {self.input_name: blob})[0][0]
+
+    def forward_batch(self, blobs):
+        if not self.dynamic_batch or len(blobs) == 1:
+            return super().forward_batch(blobs)
+        return list(self.session.run(None, {self.input_name: np.concatenate(blobs)})[0])
+
+class OpenVINOBackend(Backend):
+    def __init__(self, model_path, imgsz, threads):
+        super().__init__(model_path, imgsz, threads)
+        import openvino
+        core = openvino.Core()
+        if os.path.isdir(model_path):
+            xml_files = [f for f in os.listdir(model_path) if f.endswith(".xml")]
+            if not xml_files:
+                raise ValueError(f"No OpenVINO .xml model found in {model_path}")
+            model_path = os.path.join(model_path, xml_files[0])
+        self.model = core.compile_model(model_path, "CPU", {"INFERENCE_NUM_THREADS": threads})
+        self.output = self.model.output(0)
+
+    def forward(self, blob):
+        return self.model(blob)[self.output][0]
+
+BACKENDS = {
+    'ultralytics': UltralyticsBackend,
+    'ncnn': NCNNBackend,
+    'onnx': ONNXBackend,
+    'openvino': OpenVINOBackend,
+}
+
+def create_backend(name, model_path, imgsz=640, threads=4):
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown inference backend '{name}', expected one of {sorted(BACKENDS)}")
+    return BACKENDS[name](model_path, imgsz, threads)
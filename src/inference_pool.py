@@ -0,0 +1,168 @@
+import queue
+import threading
+import time
+from collections import namedtuple
+from contextlib import nullcontext
+from concurrent.futures import Future
+from src.config import load_config
+from src.log import get_logger
+from src.metrics import counter, gauge, histogram
+
+log = get_logger('inference')
+INFERENCE_SECONDS = histogram('smart_scale_inference_seconds', 'Time for one batched model call')
+INFERENCE_FRAMES = counter('smart_scale_inference_frames_total', 'Frames inferred', ['mode'])
+JOBS_SUBMITTED = counter('smart_scale_inference_jobs_total', 'Jobs submitted to the inference pool', ['mode'])
+TRIGGERS_DROPPED = counter('smart_scale_triggers_dropped_total', 'Weight triggers dropped because the inference queue was full')
+JOB_WAIT_SECONDS = histogram('smart_scale_inference_queue_wait_seconds', 'Time a job waited in the queue for a worker')
+QUEUE_DEPTH = gauge('smart_scale_inference_queue_depth', 'Jobs waiting for an inference worker')
+
+#frames are the ROI images around one trigger, reference_index is the one captured closest to it,
+#offset is where they sit inside the full camera frame when only the ROI crop is inferred,
+#station_id names the scale the trigger came from, mode is 'count' for weight triggers and 'track' for tracking frames
+InferenceJob = namedtuple('InferenceJob', ['frames', 'weight', 'trigger_time', 'time_triggered', 'offset', 'reference_index',
+                                           'station_id', 'mode'],
+                          defaults=((0, 0), 0, None, 'count'))
+#results holds one Results per frame, best_index is the frame that shows the voted count
+InferenceResult = namedtuple('InferenceResult', ['job', 'results', 'count', 'best_index'])
+
+class TriggerDropped(Exception):
+    pass
+
+class InferencePool:
+    def __init__(self, detector_factory, config=None):
+        if config is None:
+            config = load_config()
+        self.config = config
+
+        self.workers = config['inference'].get('workers', 1)
+        self.queue_depth = config['inference'].get('queue_depth', 8)
+        self.submit_timeout = config['inference'].get('submit_timeout', 0.5)
+        #jobs already queued are inferred together up to this many frames, so stations share each model call
+        self.max_batch = max(1, config['inference'].get('max_batch', 4))
+
+        #each worker builds its own detector, YOLO models are not safe to share between threads
+        self.detector_factory = detector_factory
+        self.jobs = queue.Queue(maxsize=self.queue_depth)
+        self.threads = []
+        self.ready = threading.Event()
+        self._loaded = 0
+        self._loaded_lock = threading.Lock()
+
+    def start(self, profiler=None):
+        #models are loaded and warmed up on the worker threads, use ready/wait_ready to know when
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, args=(profiler,), name=f"inference-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, frames, weight, trigger_time, time_triggered, offset=(0, 0), reference_index=0, station_id=None,
+               mode='count'):
+        #blocks for at most submit_timeout when the queue is full, then counts and logs the trigger as dropped
+        job = InferenceJob(frames, weight, trigger_time, time_triggered, offset, reference_index, station_id, mode)
+        future = Future()
+        #when the job was queued, to measure how long it waited for a worker
+        future.submitted = time.perf_counter()
+        JOBS_SUBMITTED.labels(mode).inc()
+        try:
+            if mode == 'track':
+                #tracking frames never hold up the loop, the next frame simply tries again
+                self.jobs.put_nowait((job, future))
+            else:
+                self.jobs.put((job, future), timeout=self.submit_timeout)
+        except queue.Full:
+            if mode != 'track':
+                TRIGGERS_DROPPED.inc()
+                log.warning("Inference queue full, dropped trigger at %s with weight %s", time_triggered, weight)
+            future.set_exception(TriggerDropped(f"Trigger at {time_triggered} dropped"))
+        return future
+
+    def wait_ready(self, timeout=None):
+        return self.ready.wait(timeout)
+
+    def pending(self):
+        return self.jobs.qsize()
+
+    def _worker(self, profiler):
+        name = threading.current_thread().name
+        phase = profiler.phase if profiler is not None else (lambda _: nullcontext())
+        try:
+            with phase(f"{name} model load"):
+                detector = self.detector_factory(self.config)
+            with phase(f"{name} model warmup"):
+                detector.warmup()
+            with self._loaded_lock:
+                self._loaded += 1
+                if self._loaded == self.workers:
+                    self.ready.set()
+        except Exception as e:
+            log.error("Failed to load detector: %s", e)
+            detector = None
+
+        stopping = False
+        while not stopping:
+            batch, stopping = self._next_batch()
+            batch = [(job, future) for job, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            if detector is None:
+                for _, future in batch:
+                    future.set_exception(RuntimeError("Detector is not loaded"))
+                continue
+            self._run_batch(detector, batch)
+
+    def _next_batch(self):
+        #waits for one job, then takes whatever else is already queued while it fits in max_batch frames
+        item = self.jobs.get()
+        if item is None:
+            return [], True
+        batch, frames = [item], len(item[0].frames)
+        while frames < self.max_batch:
+            try:
+                item = self.jobs.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+            frames += len(item[0].frames)
+        return batch, False
+
+    def _run_batch(self, detector, batch):
+        #one model call at the lowest threshold any job needs, count jobs drop the weaker boxes afterwards
+        conf_threshold = min(detector.track_conf if job.mode == 'track' else detector.conf_threshold for job, _ in batch)
+        start = time.perf_counter()
+        for job, future in batch:
+            JOB_WAIT_SECONDS.observe(start - future.submitted)
+            INFERENCE_FRAMES.labels(job.mode).inc(len(job.frames))
+        try:
+            with INFERENCE_SECONDS.time():
+                results = detector.detect_batch([frame for job, _ in batch for frame in job.frames], conf_threshold)
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        start = 0
+        for job, future in batch:
+            job_results = results[start:start + len(job.frames)]
+            start += len(job.frames)
+            try:
+                if job.offset != (0, 0):
+                    for result in job_results:
+                        result.translate(*job.offset)
+                if job.mode == 'track':
+                    future.set_result(InferenceResult(job, job_results, len(job_results[0].boxes), 0))
+                    continue
+                if conf_threshold < detector.conf_threshold:
+                    job_results = [result.filter(result.boxes.conf > detector.conf_threshold) for result in job_results]
+                count, best_index = detector.vote_count(job_results, job.reference_index)
+                future.set_result(InferenceResult(job, job_results, count, best_index))
+            except Exception as e:
+                future.set_exception(e)
+
+    def stop(self):
+        #queued jobs are finished before the workers exit
+        for _ in self.threads:
+            self.jobs.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
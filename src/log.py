@@ -0,0 +1,109 @@
+import atexit
+import json
+import logging
+import threading
+import time
+
+class RateLimitFilter(logging.Filter):
+    #lets each call site log at most burst messages per interval and reports how many were held back
+    def __init__(self, burst=10, interval=60.0):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self._sites = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if self.burst <= 0 or record.levelno >= logging.ERROR or getattr(record, 'rate_limit_summary', False):
+            return True
+        #the unformatted message identifies the call site, the arguments differ from call to call
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            #a call site that went quiet is reported when its window closes, not when it next logs
+            expired = self._expire(now)
+            start, count, suppressed, levelno = self._sites.get(key, (now, 0, 0, record.levelno))
+            passed = count < self.burst
+            if passed:
+                count += 1
+            else:
+                suppressed += 1
+            self._sites[key] = (start, count, suppressed, levelno)
+        self._report(expired)
+        return passed
+
+    def _expire(self, now=None):
+        #removes the sites whose window closed, or all of them when now is None, and returns those that held messages back
+        expired = []
+        for key, (start, count, suppressed, levelno) in list(self._sites.items()):
+            if now is None or now - start >= self.interval:
+                del self._sites[key]
+                if suppressed:
+                    expired.append((key, suppressed, levelno))
+        return expired
+
+    def _report(self, expired):
+        for (name, msg), suppressed, levelno in expired:
+            record = logging.LogRecord(name, levelno, __file__, 0, "Rate limit held back messages like %r", (msg,), None)
+            record.suppressed = suppressed
+            record.rate_limit_summary = True
+            logging.getLogger(name).handle(record)
+
+    def flush(self):
+        #reports every held back count, called when logging is reconfigured and at exit
+        with self._lock:
+            expired = self._expire()
+        self._report(expired)
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record):
+        text = super().format(record)
+        suppressed = getattr(record, 'suppressed', 0)
+        return f"{text} (suppressed {suppressed} similar)" if suppressed else text
+
+class JSONFormatter(logging.Formatter):
+    #one JSON object per line for log shippers, extra={'fields': {...}} adds fields
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update(getattr(record, 'fields', {}))
+        if getattr(record, 'suppressed', 0):
+            entry['suppressed'] = record.suppressed
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+def flush_rate_limits():
+    for handler in logging.getLogger('smart_scale').handlers:
+        for log_filter in handler.filters:
+            if isinstance(log_filter, RateLimitFilter):
+                log_filter.flush()
+
+atexit.register(flush_rate_limits)
+
+def setup_logging(config=None):
+    #configures the smart_scale loggers once from the logging section, safe to call again
+    settings = (config.get('logging') if config is not None else None) or {}
+    logger = logging.getLogger('smart_scale')
+    logger.setLevel(settings.get('level', 'INFO').upper())
+    #counts held back by the old handler are reported before it goes
+    flush_rate_limits()
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    handler = logging.StreamHandler()
+    handler.setFormatter(JSONFormatter() if settings.get('format', 'text') == 'json' else TextFormatter())
+    handler.addFilter(RateLimitFilter(settings.get('rate_limit', 10), settings.get('rate_interval', 60.0)))
+    logger.addHandler(handler)
+    logger.propagate = False
+    return logger
+
+def get_logger(name):
+    #every module logs under smart_scale.<name> so one setup_logging call covers them all
+    return logging.getLogger(f"smart_scale.{name}")
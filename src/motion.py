@@ -0,0 +1,64 @@
+import time
+import cv2
+import numpy as np
+from src.config import load_config
+
+class MotionGate:
+    #decides whether the ROI changed enough since the last inferred frame to be worth another inference,
+    #by differencing small grayscale copies of the ROI inside the cached circular mask
+    def __init__(self, image_processor, config=None):
+        if config is None:
+            config = load_config()
+        self.config = config
+
+        motion = config.get('motion') or {}
+        self.enabled = motion.get('enabled', True)
+        self.width = motion.get('width', 64)
+        self.pixel_threshold = motion.get('pixel_threshold', 25)
+        self.min_area = motion.get('min_area', 0.01)
+        self.max_interval = motion.get('max_interval', 5.0)
+
+        self.image_processor = image_processor
+        self.reference = None
+        self._last_inference = 0.0
+        self.skipped = 0
+
+    def _small(self, frame, center, radius):
+        height, width = frame.shape[:2]
+        x0, y0 = max(0, center[0] - radius), max(0, center[1] - radius)
+        x1, y1 = min(width, center[0] + radius + 1), min(height, center[1] + radius + 1)
+        crop = frame[y0:y1, x0:x1]
+        scale = self.width / crop.shape[1]
+        size = (self.width, max(1, int(round(crop.shape[0] * scale))))
+        gray = cv2.cvtColor(cv2.resize(crop, size, interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+        #blur so sensor noise and compression artifacts do not read as motion
+        gray = cv2.GaussianBlur(gray, (3, 3), 0)
+        mask = self.image_processor.create_circular_mask(
+            gray.shape, ((center[0] - x0) * size[0] // crop.shape[1], (center[1] - y0) * size[1] // crop.shape[0]),
+            int(radius * scale))
+        return gray, mask
+
+    def changed(self, frame, center, radius):
+        #True when frame should be inferred, the caller then infers it and it becomes the new reference
+        if not self.enabled:
+            return True
+        gray, mask = self._small(frame, center, radius)
+        now = time.monotonic()
+        if (self.reference is None or self.reference.shape != gray.shape
+                or now - self._last_inference >= self.max_interval):
+            self._accept(gray, now)
+            return True
+        moving = cv2.bitwise_and(cv2.absdiff(gray, self.reference), mask) > self.pixel_threshold
+        if np.count_nonzero(moving) > self.min_area * np.count_nonzero(mask):
+            self._accept(gray, now)
+            return True
+        self.skipped += 1
+        return False
+
+    def reset(self):
+        #the next frame is inferred, e.g. when the reference frame never reached the tracker
+        self.reference = None
+
+    def _accept(self, gray, now):
+        self.reference = gray
+        self._last_inference = now
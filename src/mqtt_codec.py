@@ -0,0 +1,45 @@
+import json
+
+#payload encodings for the data topic, json is sent on topic_data itself, the others on topic_data/<encoding>
+ENCODINGS = ('json', 'msgpack', 'cbor')
+
+def data_topic(topic_data, encoding):
+    return topic_data if encoding == 'json' else f"{topic_data}/{encoding}"
+
+def topic_encoding(topic_data, topic):
+    #the encoding a message on topic was sent with, None if topic is not a data topic
+    if topic == topic_data:
+        return 'json'
+    encoding = topic[len(topic_data) + 1:] if topic.startswith(topic_data + "/") else None
+    return encoding if encoding in ENCODINGS else None
+
+def check_encoding(encoding):
+    #raises ImportError at startup rather than on the first event when the package for encoding is missing
+    if encoding == 'msgpack':
+        import msgpack
+    elif encoding == 'cbor':
+        import cbor2
+
+def encode(payload, encoding='json'):
+    #msgpack and cbor2 are only imported when configured, the default json needs nothing extra
+    if encoding == 'msgpack':
+        import msgpack
+        return msgpack.packb(payload, use_bin_type=True)
+    if encoding == 'cbor':
+        import cbor2
+        return cbor2.dumps(payload)
+    return json.dumps(payload).encode()
+
+def decode(payload, encoding='json'):
+    if encoding == 'msgpack':
+        import msgpack
+        return msgpack.unpackb(payload, raw=False)
+    if encoding == 'cbor':
+        import cbor2
+        return cbor2.loads(payload)
+    return json.loads(payload)
+
+def decode_events(payload, encoding='json'):
+    #a batched message holds a list of events, a single event is sent as is
+    data = decode(payload, encoding)
+    return data if isinstance(data, list) else [data]
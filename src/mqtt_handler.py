@@ -1,43 +1,127 @@
 import paho.mqtt.client as mqtt
-import yaml
 import json
+import os
+import queue
+import threading
+import time
+from collections import deque
 from datetime import datetime
+from src.config import load_config
+from src.log import get_logger
+from src.metrics import counter, gauge, histogram
+from src.mqtt_codec import check_encoding, data_topic, encode
+from src.stabilizer import WeightStabilizer
+
+log = get_logger('mqtt')
+READINGS_RECEIVED = counter('smart_scale_weight_readings_total', 'Weight readings received', ['station'])
+TRIGGERS_RECEIVED = counter('smart_scale_triggers_total', 'Placements whose weight settled above the threshold', ['station'])
+PUBLISH_SECONDS = histogram('smart_scale_mqtt_publish_seconds', 'Time to encode and hand one data message to the MQTT client')
+EVENTS_PUBLISHED = counter('smart_scale_mqtt_events_published_total', 'Data events published')
+EVENTS_SPOOLED = counter('smart_scale_mqtt_events_spooled_total', 'Data events spooled while the broker was unreachable')
+PUBLISHED_BYTES = counter('smart_scale_mqtt_published_bytes_total', 'Encoded data payload bytes published')
+MQTT_CONNECTED = gauge('smart_scale_mqtt_connected', 'Whether the MQTT client is connected')
+PUBLISH_QUEUE = gauge('smart_scale_mqtt_publish_queue', 'Data events waiting to be published')
 
 class MQTTHandler:
-    def __init__(self, config_path='config.yaml'):
-        with open(config_path, 'r') as file:
-            config = yaml.safe_load(file)
+    def __init__(self, config=None):
+        if config is None:
+            config = load_config()
+        self.config = config
         
         self.broker = config['mqtt']['broker']
         self.port = config['mqtt']['port']
         self.topic_weight = config['mqtt']['topic_weight']
         self.topic_data = config['mqtt']['topic_data']
-        self.threshold_weight = config['threshold']['weight']
+        self.topic_preview = config['mqtt'].get('topic_preview', 'smart_scale/preview')
+        self.topic_tracking = config['mqtt'].get('topic_tracking', 'smart_scale/tracking')
+        self.qos = config['mqtt'].get('qos', 1)
+        self.encoding = config['mqtt'].get('encoding', 'json')
+        check_encoding(self.encoding)
+        self.batch_size = config['mqtt'].get('batch_size', 1)
+        self.batch_interval = config['mqtt'].get('batch_interval', 5.0)
+        self.spool_path = config['mqtt'].get('spool_path', 'mqtt_spool.jsonl')
+        #spooled lines that cannot be decoded, kept for a person to look at
+        self.bad_path = self.spool_path + '.bad'
 
         self.client = mqtt.Client()
+        self.client.on_connect = self.on_connect
+        self.client.on_disconnect = self.on_disconnect
         self.client.on_message = self.on_message
+        self.client.reconnect_delay_set(min_delay=1, max_delay=60)
+        self.connected = threading.Event()
+        self.subscriptions = []
+        #data events are published by a background thread, publish_data never waits for the broker
+        self.events = queue.Queue()
+        self._thread = None
         self.current_weight = 0.0
-        self.trigger_processing = False
+        #every trigger is queued so back-to-back placements are not collapsed into one
+        self.pending_triggers = deque()
+        #weight topic -> (station id, station config, stabilizer), filled by add_station
+        self.stations = {}
+        self.stabilizer = WeightStabilizer(config)
+
+    @property
+    def threshold_weight(self):
+        #read on every message so a config reload applies immediately
+        return self.config['threshold']['weight']
 
-    def connect(self, subscribe_topic):
-        self.client.connect(self.broker, self.port, 60)
-        self.client.subscribe(subscribe_topic)
+    def add_station(self, station_id, config):
+        #one client serves every station, triggers are told apart by the topic they arrive on
+        self.stations[config['mqtt']['topic_weight']] = (station_id, config, WeightStabilizer(config))
+
+    def connect(self, subscribe_topic=None):
+        #connects in the background and keeps reconnecting, so a broker outage does not stop the scale
+        self.subscriptions = [subscribe_topic] if subscribe_topic else list(self.stations) or [self.topic_weight]
+        self.client.connect_async(self.broker, self.port, 60)
         self.client.loop_start()
+        self._thread = threading.Thread(target=self._publisher, name="mqtt-publisher", daemon=True)
+        self._thread.start()
 
     def disconnect(self):
+        #queued events are published, or spooled when the broker is unreachable
+        if self._thread is not None:
+            self.events.put(None)
+            self._thread.join()
+            self._thread = None
+        self.client.disconnect()
         self.client.loop_stop()
 
+    def on_connect(self, client, userdata, flags, rc):
+        if rc != 0:
+            log.error("MQTT connection refused with result code %s", rc)
+            return
+        log.info("Connected to MQTT broker")
+        #subscriptions do not survive a reconnect with a clean session
+        for topic in self.subscriptions:
+            client.subscribe(topic)
+        self.connected.set()
+
+    def on_disconnect(self, client, userdata, rc):
+        self.connected.clear()
+        if rc != 0:
+            log.warning("Lost connection to MQTT broker (%s), reconnecting", rc)
+
     def on_message(self, client, userdata, message):
         try:
             data = float(message.payload.decode())
-            print(f"Received data {data}")
-            if data > self.threshold_weight:
-                self.current_weight = data
-                self.trigger_processing = True
+            station_id, _, stabilizer = self.stations.get(message.topic, (None, self.config, self.stabilizer))
+            log.debug("Received data %s from %s", data, station_id)
+            READINGS_RECEIVED.labels(station_id or '').inc()
+            self.current_weight = data
+            #paho stamps messages with time.monotonic(), the same clock as the camera
+            timestamp = getattr(message, 'timestamp', None) or time.monotonic()
+            #a settling scale sends many readings per placement, only the settled one triggers
+            settled = stabilizer.add(data, timestamp)
+            if settled is not None:
+                weight, trigger_time = settled
+                log.info("Weight settled at %.3f on %s", weight, station_id)
+                TRIGGERS_RECEIVED.labels(station_id or '').inc()
+                time_triggered = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                self.pending_triggers.append((weight, trigger_time, time_triggered, station_id))
         except ValueError:
-            print("Error decoding weight")
+            log.warning("Error decoding weight %r on %s", message.payload, message.topic)
 
-    def publish_data(self, datetime, weight, count, image_path):
+    def publish_data(self, datetime, weight, count, image_path, station_id=None):
         average_weight = weight / count if count > 0 else 0
         data = {
             "datetime": datetime,
@@ -46,8 +130,131 @@ class MQTTHandler:
             "average_weight": average_weight,
             "image_path": image_path
         }
-        self.client.publish(self.topic_data, json.dumps(data))
-        print(f"Published data: {data}")
+        if station_id is not None:
+            data["station_id"] = station_id
+        self.events.put(data)
+
+    def _next_batch(self):
+        #waits up to batch_interval for batch_size events, a batch_size of 1 sends every event on its own
+        batch = []
+        deadline = time.monotonic() + self.batch_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                event = self.events.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if event is None:
+                return batch, True
+            batch.append(event)
+            if self.batch_size == 1:
+                break
+        return batch, False
+
+    def _send(self, events):
+        start = time.perf_counter()
+        payload = encode(events if self.batch_size > 1 else events[0], self.encoding)
+        info = self.client.publish(data_topic(self.topic_data, self.encoding), payload, qos=self.qos)
+        if info.rc != mqtt.MQTT_ERR_SUCCESS:
+            return False
+        PUBLISH_SECONDS.observe(time.perf_counter() - start)
+        EVENTS_PUBLISHED.inc(len(events))
+        PUBLISHED_BYTES.inc(len(payload))
+        log.info("Published %d data events (%d bytes)", len(events), len(payload))
+        return True
+
+    def _publish(self, events):
+        #with batching off every event is its own message, so a failure part way through spools only the rest
+        groups = [events] if self.batch_size > 1 else [[event] for event in events]
+        for i, group in enumerate(groups):
+            if not (self.connected.is_set() and self._send(group)):
+                return [event for rest in groups[i:] for event in rest]
+        return []
+
+    def _append(self, path, lines):
+        try:
+            with open(path, 'a') as file:
+                for line in lines:
+                    file.write(line + "\n")
+        except OSError as e:
+            log.error("Could not write %d data events to %s, they are lost: %s", len(lines), path, e)
+
+    def _spool(self, events):
+        self._append(self.spool_path, [json.dumps(event, default=str) for event in events])
+        EVENTS_SPOOLED.inc(len(events))
+        log.warning("MQTT broker unreachable, spooled %d data events", len(events))
+
+    def _read_spool(self):
+        #a power cut can leave a truncated last line, lines that do not decode are moved to the .bad file
+        events, bad = [], []
+        with open(self.spool_path, 'r') as file:
+            for line in file:
+                if not line.strip():
+                    continue
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    event = None
+                if not isinstance(event, dict):
+                    bad.append(line.rstrip("\n"))
+                    continue
+                events.append(event)
+        if bad:
+            log.warning("Skipped %d unreadable spooled data events, moved them to %s", len(bad), self.bad_path)
+            self._append(self.bad_path, bad)
+        return events
+
+    def _replay_spool(self):
+        #events spooled while the broker was down are sent before any new ones
+        #the spool is only changed after sending, a crash part way sends some events twice but loses none
+        if not os.path.exists(self.spool_path):
+            return
+        events = self._read_spool()
+        for start in range(0, len(events), self.batch_size):
+            failed = self._publish(events[start:start + self.batch_size])
+            if failed:
+                temp_path = self.spool_path + '.tmp'
+                with open(temp_path, 'w') as file:
+                    for event in failed + events[start + self.batch_size:]:
+                        file.write(json.dumps(event, default=str) + "\n")
+                os.replace(temp_path, self.spool_path)
+                return
+        os.remove(self.spool_path)
+        if events:
+            log.info("Replayed %d spooled data events", len(events))
+
+    def _publisher(self):
+        stopping = False
+        while not stopping:
+            batch, stopping = self._next_batch()
+            #nothing may end this thread early, queued events would pile up and never be published or spooled
+            if self.connected.is_set():
+                try:
+                    self._replay_spool()
+                except Exception as e:
+                    log.error("Could not replay %s: %s", self.spool_path, e)
+            if batch:
+                try:
+                    failed = self._publish(batch)
+                except Exception as e:
+                    log.error("Could not publish %d data events, spooling them: %s", len(batch), e)
+                    failed = batch
+                if failed:
+                    self._spool(failed)
+
+    def publish_tracking(self, counts, station_id):
+        #the latest counts replace the previous ones, retained so a subscriber gets them as soon as it connects
+        data = dict(counts, station_id=station_id, datetime=datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+        self.client.publish(f"{self.topic_tracking}/{station_id}", json.dumps(data), qos=0, retain=True)
+
+    def publish_preview(self, jpeg_bytes, topic=None):
+        #previews are disposable, a lost one is simply replaced by the next
+        self.client.publish(topic or self.topic_preview, jpeg_bytes, qos=0)
 
-    def reset_trigger(self):
-        self.trigger_processing = False
\ No newline at end of file
+    def pop_triggers(self):
+        triggers = []
+        while self.pending_triggers:
+            triggers.append(self.pending_triggers.popleft())
+        return triggers
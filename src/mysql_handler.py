@@ -1,41 +1,480 @@
-import mysql.connector
-import yaml
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import closing, nullcontext
+from datetime import datetime
+from src.config import load_config
+from src.log import get_logger
+from src.metrics import counter, gauge, histogram
+
+log = get_logger('mysql')
+INSERT_SECONDS = histogram('smart_scale_mysql_insert_seconds', 'Time to insert one batch of rows and update the rollups')
+ROWS_WRITTEN = counter('smart_scale_mysql_rows_written_total', 'Detection rows written to the database')
+ROWS_SPOOLED = counter('smart_scale_mysql_rows_spooled_total', 'Detection rows spooled while the database was unreachable')
+ROWS_REJECTED = counter('smart_scale_mysql_rows_rejected_total', 'Detection rows the database rejected, moved to the .bad file')
+DB_CONNECTED = gauge('smart_scale_mysql_connected', 'Whether the database is connected')
+WRITE_QUEUE = gauge('smart_scale_mysql_write_queue', 'Detection rows waiting for the database writer')
 
 class MYSQLHandler:
-    def __init__(self, config_path='config.yaml'):
-        with open(config_path, 'r') as file:
-            config = yaml.safe_load(file)
-        
-        self.conn = mysql.connector.connect(host = config['mysql']['host'],
-        user = config['mysql']['user'],
-        database = config['mysql']['database'])
-
-        self.cursor = self.conn.cursor()
-        self.create_table_if_not_exists()
-
-    def create_table_if_not_exists(self):
-        # Check if the table exists and create it if not
-        self.cursor.execute("""
+    def __init__(self, config=None):
+        if config is None:
+            config = load_config()
+        self.config = config
+
+        self.driver = config['mysql'].get('driver', 'mysql')
+        self.host = config['mysql']['host']
+        self.user = config['mysql']['user']
+        self.password = config['mysql'].get('password', '')
+        self.database = config['mysql']['database']
+        self.sqlite_path = config['mysql'].get('sqlite_path', 'smart_scale.db')
+        self.connect_timeout = config['mysql'].get('connect_timeout', 10)
+        self.pool_size = config['mysql'].get('pool_size', 2)
+        self.batch_size = config['mysql'].get('batch_size', 20)
+        self.flush_interval = config['mysql'].get('flush_interval', 2.0)
+        self.retry_interval = config['mysql'].get('retry_interval', 5.0)
+        self.spool_path = config['mysql'].get('spool_path', 'mysql_spool.jsonl')
+        #rows that can never be written, kept next to the spool for a person to look at
+        self.bad_path = self.spool_path + '.bad'
+        self.device_id = config['mysql'].get('device_id', 'scale-1')
+
+        #mysql uses %s placeholders, the sqlite stand-in uses ?
+        self.placeholder = '?' if self.driver == 'sqlite' else '%s'
+        self.errors = (sqlite3.Error, OSError, ImportError)
+        #errors meaning the database is unreachable, anything else in errors means it rejected the data
+        self.connection_errors = (sqlite3.OperationalError, OSError, ImportError)
+        self.pool = None
+        self.connected = threading.Event()
+        self.rows = queue.Queue()
+        #(device id, hour) -> (entered, exited) tracking crossings not yet written, summed in memory between writes
+        self.crossings = {}
+        self._crossings_lock = threading.Lock()
+        self._thread = None
+        self._last_attempt = 0.0
+
+    def start(self, profiler=None):
+        #rows are written by a background thread, log_detection never waits for the database
+        self._thread = threading.Thread(target=self._writer, args=(profiler,), name="mysql-writer", daemon=True)
+        self._thread.start()
+
+    def connect(self, migrate=True):
+        #readers such as websocket_server pass migrate=False, only main.py changes the schema
+        if self.driver == 'sqlite':
+            self.pool = 'sqlite'
+        else:
+            #mysql.connector is imported here so it does not slow down process startup
+            import mysql.connector
+            import mysql.connector.pooling
+            self.errors = (mysql.connector.Error, sqlite3.Error, OSError, ImportError)
+            self.connection_errors = (mysql.connector.errors.InterfaceError, mysql.connector.errors.OperationalError,
+                                      mysql.connector.errors.PoolError, sqlite3.OperationalError, OSError, ImportError)
+            if migrate:
+                self.pool = mysql.connector.pooling.MySQLConnectionPool(
+                    pool_name="smart_scale",
+                    pool_size=self.pool_size,
+                    pool_reset_session=False,
+                    host = self.host,
+                    user = self.user,
+                    password = self.password,
+                    database = self.database,
+                    connection_timeout = self.connect_timeout)
+            else:
+                #a reader opens a connection per query instead of holding a pool open
+                self.pool = 'direct'
+
+        if migrate:
+            with self.get_connection() as conn:
+                self.migrate(conn)
+        self.connected.set()
+
+    def get_connection(self):
+        #a pooled connection, closing it hands it back to the pool
+        if self.pool is None:
+            raise OSError("Database is not connected")
+        if self.pool == 'sqlite':
+            return closing(sqlite3.connect(self.sqlite_path, timeout=self.connect_timeout))
+        if self.pool == 'direct':
+            import mysql.connector
+            return closing(mysql.connector.connect(host=self.host, user=self.user, password=self.password,
+                                                   database=self.database, connection_timeout=self.connect_timeout))
+        return closing(self.pool.get_connection())
+
+    def migrations(self):
+        #each entry upgrades the schema by one version, applied versions are recorded in schema_version
+        #DDL commits on its own, so every step must be safe to run again after a power cut part way through a version
+        sqlite = self.driver == 'sqlite'
+        id_column = "id INTEGER PRIMARY KEY AUTOINCREMENT" if sqlite else "id INT AUTO_INCREMENT PRIMARY KEY"
+        hour_bucket = ("strftime('%Y-%m-%d %H:00:00', timestamp)" if sqlite
+                       else "DATE_FORMAT(timestamp, '%Y-%m-%d %H:00:00')")
+        day_bucket = "date(timestamp)" if sqlite else "DATE(timestamp)"
+        #DDL takes no placeholders, rows logged before device ids existed belong to the configured device
+        device_id = "'" + self.device_id.replace("'", "''") + "'"
+        if not sqlite:
+            device_id = device_id.replace("\\", "\\\\")
+        rollup_columns = """
+                device_id VARCHAR(64) NOT NULL,
+                bucket {bucket_type} NOT NULL,
+                events INT NOT NULL,
+                total_count INT NOT NULL,
+                total_weight DOUBLE NOT NULL,
+                PRIMARY KEY (device_id, bucket)
+        """
+        return [
+            [f"""
             CREATE TABLE IF NOT EXISTS detection_logs (
-                id INT AUTO_INCREMENT PRIMARY KEY,
+                {id_column},
                 timestamp DATETIME,
                 weight FLOAT,
                 count INT,
                 image_path VARCHAR(255)
             )
-        """)
-        self.conn.commit()
+            """],
+            [lambda cursor: self._add_column(cursor, 'detection_logs', 'device_id',
+                                             f"VARCHAR(64) NOT NULL DEFAULT {device_id}"),
+             lambda cursor: self._create_index(cursor, 'detection_logs', 'idx_detection_logs_timestamp', "timestamp"),
+             lambda cursor: self._create_index(cursor, 'detection_logs', 'idx_detection_logs_device_timestamp',
+                                               "device_id, timestamp")],
+            [f"CREATE TABLE IF NOT EXISTS detection_hourly ({rollup_columns.format(bucket_type='DATETIME')})",
+             f"CREATE TABLE IF NOT EXISTS detection_daily ({rollup_columns.format(bucket_type='DATE')})",
+             #backfill the rollups from rows logged before they existed, a backfill cut short is redone from scratch
+             "DELETE FROM detection_hourly",
+             "DELETE FROM detection_daily",
+             f"""INSERT INTO detection_hourly (device_id, bucket, events, total_count, total_weight)
+                 SELECT device_id, {hour_bucket}, COUNT(*), SUM(count), SUM(weight)
+                 FROM detection_logs GROUP BY device_id, {hour_bucket}""",
+             f"""INSERT INTO detection_daily (device_id, bucket, events, total_count, total_weight)
+                 SELECT device_id, {day_bucket}, COUNT(*), SUM(count), SUM(weight)
+                 FROM detection_logs GROUP BY device_id, {day_bucket}"""],
+            ["""
+            CREATE TABLE IF NOT EXISTS crossing_hourly (
+                device_id VARCHAR(64) NOT NULL,
+                bucket DATETIME NOT NULL,
+                entered INT NOT NULL,
+                exited INT NOT NULL,
+                PRIMARY KEY (device_id, bucket)
+            )
+            """],
+        ]
 
-    def log_detection(self, timestamp, weight, count, image_path):
-        sql = "INSERT INTO detection_logs (timestamp, weight, count, image_path) VALUES (%s, %s, %s, %s)"
-        values = (timestamp, weight, count, image_path)
-        self.cursor.execute(sql, values)
-        self.conn.commit()
+    def _has_column(self, cursor, table, column):
+        if self.driver == 'sqlite':
+            cursor.execute(f"PRAGMA table_info({table})")
+            return any(row[1] == column for row in cursor.fetchall())
+        cursor.execute("SELECT COUNT(*) FROM information_schema.COLUMNS"
+                       " WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s", (table, column))
+        return cursor.fetchone()[0] > 0
 
-    def close(self):
-        self.cursor.close()
-        self.conn.close()
-        
+    def _has_index(self, cursor, table, index):
+        if self.driver == 'sqlite':
+            cursor.execute(f"PRAGMA index_list({table})")
+            return any(row[1] == index for row in cursor.fetchall())
+        cursor.execute("SELECT COUNT(*) FROM information_schema.STATISTICS"
+                       " WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s", (table, index))
+        return cursor.fetchone()[0] > 0
+
+    def _add_column(self, cursor, table, column, definition):
+        #MySQL has no ADD COLUMN IF NOT EXISTS
+        if not self._has_column(cursor, table, column):
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+    def _create_index(self, cursor, table, index, columns):
+        if not self._has_index(cursor, table, index):
+            cursor.execute(f"CREATE INDEX {index} ON {table} ({columns})")
+
+    def migrate(self, conn):
+        cursor = conn.cursor()
+        cursor.execute("CREATE TABLE IF NOT EXISTS schema_version (version INT NOT NULL)")
+        cursor.execute("SELECT MAX(version) FROM schema_version")
+        current = cursor.fetchone()[0] or 0
+        for version, statements in enumerate(self.migrations(), start=1):
+            if version <= current:
+                continue
+            #steps are SQL, or functions of the cursor for DDL that needs checking first
+            for statement in statements:
+                if callable(statement):
+                    statement(cursor)
+                else:
+                    cursor.execute(statement)
+            cursor.execute(f"INSERT INTO schema_version (version) VALUES ({self.placeholder})", (version,))
+            conn.commit()
+            log.info("Database schema migrated to version %d", version)
+        cursor.close()
+
+    def log_detection(self, timestamp, weight, count, image_path, device_id=None):
+        self.rows.put((timestamp, weight, count, image_path, device_id or self.device_id))
+
+    def log_crossings(self, timestamp, entered, exited, device_id=None):
+        #birds the tracker saw cross the ROI circle, stored per hour in crossing_hourly
+        self._add_crossings((device_id or self.device_id, timestamp.strftime("%Y-%m-%d %H:00:00")), entered, exited)
+
+    def _add_crossings(self, key, entered, exited):
+        with self._crossings_lock:
+            previous = self.crossings.get(key, (0, 0))
+            self.crossings[key] = (previous[0] + entered, previous[1] + exited)
+
+    def _next_batch(self):
+        #waits for a first row, then collects until batch_size rows or flush_interval has passed
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                row = self.rows.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if row is None:
+                return batch, True
+            batch.append(row)
+        return batch, False
+
+    def _try_connect(self, profiler):
+        if time.monotonic() - self._last_attempt < self.retry_interval:
+            return
+        self._last_attempt = time.monotonic()
+        phase = profiler.phase("mysql connect") if profiler is not None else nullcontext()
+        try:
+            with phase:
+                self.connect()
+            log.info("Connected to database")
+        except self.errors as e:
+            log.warning("Failed to connect to database: %s", e)
+            self.pool = None
 
-        
-    
\ No newline at end of file
+    def _rollup(self, rows):
+        #sums the batch per device and hour/day so each bucket gets a single upsert
+        hourly, daily = {}, {}
+        for timestamp, weight, count, _, device_id in rows:
+            if not isinstance(timestamp, datetime):
+                timestamp = datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S")
+            for buckets, bucket in ((hourly, timestamp.strftime("%Y-%m-%d %H:00:00")),
+                                    (daily, timestamp.strftime("%Y-%m-%d"))):
+                events, total_count, total_weight = buckets.get((device_id, bucket), (0, 0, 0.0))
+                buckets[(device_id, bucket)] = (events + 1, total_count + count, total_weight + weight)
+        return ([key + value for key, value in hourly.items()],
+                [key + value for key, value in daily.items()])
+
+    def _upsert_sql(self, table):
+        values = ", ".join([self.placeholder] * 5)
+        sql = f"INSERT INTO {table} (device_id, bucket, events, total_count, total_weight) VALUES ({values})"
+        if self.driver == 'sqlite':
+            return sql + (" ON CONFLICT(device_id, bucket) DO UPDATE SET"
+                          " events = events + excluded.events,"
+                          " total_count = total_count + excluded.total_count,"
+                          " total_weight = total_weight + excluded.total_weight")
+        return sql + (" ON DUPLICATE KEY UPDATE"
+                      " events = events + VALUES(events),"
+                      " total_count = total_count + VALUES(total_count),"
+                      " total_weight = total_weight + VALUES(total_weight)")
+
+    def _insert(self, rows):
+        sql = ("INSERT INTO detection_logs (timestamp, weight, count, image_path, device_id) VALUES "
+               f"({', '.join([self.placeholder] * 5)})")
+        hourly, daily = self._rollup(rows)
+        #the raw rows and their rollups are committed together
+        self._commit([(sql, rows),
+                      (self._upsert_sql('detection_hourly'), hourly),
+                      (self._upsert_sql('detection_daily'), daily)])
+
+    def _commit(self, statements):
+        #runs each (sql, rows) pair with executemany in a single transaction
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            try:
+                for sql, rows in statements:
+                    cursor.executemany(sql, rows)
+                conn.commit()
+            except self.errors:
+                #a half-done batch would otherwise keep its locks, or go back to the pool mid-transaction
+                try:
+                    conn.rollback()
+                except self.errors:
+                    pass
+                raise
+            finally:
+                cursor.close()
+
+    def _write(self, rows):
+        #returns the rows still to be written, empty unless the database went away part way
+        try:
+            with INSERT_SECONDS.time():
+                self._insert(rows)
+            ROWS_WRITTEN.inc(len(rows))
+            return []
+        except self.connection_errors as e:
+            log.warning("Database write failed, spooling %d rows: %s", len(rows), e)
+            self.connected.clear()
+            self.pool = None
+            return rows
+        except self.errors + (ValueError, TypeError) as e:
+            #the database is up but refuses the data, retrying it would fail forever
+            if len(rows) == 1:
+                log.warning("Database rejected row %s, moving it to %s: %s", rows[0], self.bad_path, e)
+                ROWS_REJECTED.inc()
+                self._append(self.bad_path, [json.dumps(rows[0], default=str)])
+                return []
+        #one row in the batch is bad, write them one at a time so only that row is set aside
+        for i, row in enumerate(rows):
+            if self._write([row]):
+                return rows[i:]
+        return []
+
+    def _write_crossings(self):
+        with self._crossings_lock:
+            crossings, self.crossings = self.crossings, {}
+        if not crossings:
+            return
+        values = ", ".join([self.placeholder] * 4)
+        sql = f"INSERT INTO crossing_hourly (device_id, bucket, entered, exited) VALUES ({values})"
+        if self.driver == 'sqlite':
+            sql += (" ON CONFLICT(device_id, bucket) DO UPDATE SET"
+                    " entered = entered + excluded.entered, exited = exited + excluded.exited")
+        else:
+            sql += " ON DUPLICATE KEY UPDATE entered = entered + VALUES(entered), exited = exited + VALUES(exited)"
+        try:
+            self._commit([(sql, [key + value for key, value in crossings.items()])])
+        except self.connection_errors as e:
+            #only sums, so they stay in memory and are merged with new crossings until the next write
+            log.warning("Database write of crossing counts failed, retrying later: %s", e)
+            self.connected.clear()
+            self.pool = None
+            for key, (entered, exited) in crossings.items():
+                self._add_crossings(key, entered, exited)
+        except self.errors as e:
+            log.warning("Database rejected crossing counts %s: %s", crossings, e)
+
+    def _append(self, path, lines):
+        try:
+            with open(path, 'a') as file:
+                for line in lines:
+                    file.write(line + "\n")
+        except OSError as e:
+            log.error("Could not write %d rows to %s, they are lost: %s", len(lines), path, e)
+
+    def _spool(self, rows):
+        ROWS_SPOOLED.inc(len(rows))
+        self._append(self.spool_path, [json.dumps(row, default=str) for row in rows])
+
+    def _read_spool(self):
+        #a power cut can leave a truncated last line, lines that do not parse are moved to the .bad file
+        rows, bad = [], []
+        with open(self.spool_path, 'r') as file:
+            for line in file:
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    row = None
+                if not isinstance(row, list) or len(row) not in (4, 5):
+                    bad.append(line.rstrip("\n"))
+                    continue
+                #rows spooled before device ids were logged belong to this device
+                rows.append(tuple(row) if len(row) == 5 else tuple(row) + (self.device_id,))
+        if bad:
+            log.warning("Skipped %d unreadable spooled rows, moved them to %s", len(bad), self.bad_path)
+            ROWS_REJECTED.inc(len(bad))
+            self._append(self.bad_path, bad)
+        return rows
+
+    def _replay_spool(self):
+        #rows spooled while the database was down are written before any new ones
+        if not os.path.exists(self.spool_path):
+            return
+        rows = self._read_spool()
+        pending = self._write(rows) if rows else []
+        if pending:
+            #keep only what was not written, replaced in one step so a crash cannot lose the spool
+            temp_path = self.spool_path + '.tmp'
+            with open(temp_path, 'w') as file:
+                for row in pending:
+                    file.write(json.dumps(row, default=str) + "\n")
+            os.replace(temp_path, self.spool_path)
+            return
+        os.remove(self.spool_path)
+        if rows:
+            log.info("Replayed %d spooled rows", len(rows))
+
+    def _writer(self, profiler):
+        stopping = False
+        while not stopping:
+            batch, stopping = self._next_batch()
+            if not self.connected.is_set():
+                self._try_connect(profiler)
+            if self.connected.is_set():
+                try:
+                    self._replay_spool()
+                except OSError as e:
+                    log.error("Could not replay %s: %s", self.spool_path, e)
+            pending = self._write(batch) if batch and self.connected.is_set() else batch
+            if pending:
+                self._spool(pending)
+            if self.connected.is_set():
+                self._write_crossings()
+        if self.crossings:
+            log.warning("Database unreachable, %d hours of crossing counts were not stored", len(self.crossings))
+
+    def _query(self, sql, params):
+        if not self.connected.is_set():
+            raise OSError("Database is not connected")
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql, params)
+            columns = [column[0] for column in cursor.description]
+            rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+            cursor.close()
+        return rows
+
+    def _get_rollup(self, table, start, end, device_id):
+        sql = (f"SELECT device_id, bucket, events, total_count, total_weight FROM {table} "
+               f"WHERE bucket >= {self.placeholder} AND bucket < {self.placeholder}")
+        params = [str(start), str(end)]
+        if device_id is not None:
+            sql += f" AND device_id = {self.placeholder}"
+            params.append(device_id)
+        rows = self._query(sql + " ORDER BY bucket, device_id", params)
+        for row in rows:
+            row['average_weight'] = row['total_weight'] / row['total_count'] if row['total_count'] else 0
+        return rows
+
+    def get_hourly_stats(self, start, end, device_id=None):
+        #per-hour events, bird count and weight in [start, end), read from the rollup table
+        return self._get_rollup('detection_hourly', start, end, device_id)
+
+    def get_daily_stats(self, start, end, device_id=None):
+        #per-day events, bird count and weight in [start, end), read from the rollup table
+        return self._get_rollup('detection_daily', start, end, device_id)
+
+    def get_crossing_stats(self, start, end, device_id=None):
+        #per-hour birds entering and leaving the ROI in [start, end), counted by the tracker
+        sql = ("SELECT device_id, bucket, entered, exited FROM crossing_hourly "
+               f"WHERE bucket >= {self.placeholder} AND bucket < {self.placeholder}")
+        params = [str(start), str(end)]
+        if device_id is not None:
+            sql += f" AND device_id = {self.placeholder}"
+            params.append(device_id)
+        return self._query(sql + " ORDER BY bucket, device_id", params)
+
+    def get_detections(self, start, end, device_id=None, limit=1000):
+        #raw rows in [start, end), served from the timestamp index
+        sql = ("SELECT timestamp, weight, count, image_path, device_id FROM detection_logs "
+               f"WHERE timestamp >= {self.placeholder} AND timestamp < {self.placeholder}")
+        params = [str(start), str(end)]
+        if device_id is not None:
+            sql += f" AND device_id = {self.placeholder}"
+            params.append(device_id)
+        sql += f" ORDER BY timestamp LIMIT {int(limit)}"
+        return self._query(sql, params)
+
+    def close(self):
+        #flushes queued rows, to the database or to the spool file
+        if self._thread is not None:
+            self.rows.put(None)
+            self._thread.join()
+            self._thread = None
+        #pooled connections are closed once nothing refers to the pool any more
+        self.connected.clear()
+        self.pool = None
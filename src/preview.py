@@ -0,0 +1,52 @@
+import time
+import cv2
+from src.config import load_config
+
+class Preview:
+    def __init__(self, mqtt_handler, image_processor, config=None, name=None, headless=False):
+        if config is None:
+            config = load_config()
+        self.config = config
+
+        #main.py --headless is passed in rather than written into the config, where a reload would see it as a change
+        self.headless = headless or config['display'].get('headless', False)
+        self.stream = config['display'].get('stream', True)
+        self.scale = config['display'].get('scale', 0.5)
+        self.jpeg_quality = config['display'].get('jpeg_quality', 70)
+        self.topic = config['mqtt'].get('topic_preview', 'smart_scale/preview')
+        self.window_name = f"Chicken Detection {name}" if name else "Chicken Detection"
+
+        self.mqtt_handler = mqtt_handler
+        self.image_processor = image_processor
+        self._last_shown = 0.0
+
+    @property
+    def fps(self):
+        #0 means the preview is only rendered for trigger results
+        return self.config['display'].get('preview_fps', 2)
+
+    def due(self):
+        return self.fps > 0 and time.monotonic() - self._last_shown >= 1.0 / self.fps
+
+    def show(self, frame):
+        self._last_shown = time.monotonic()
+        height, width = frame.shape[:2]
+        size = (int(width * self.scale), int(height * self.scale))
+        small = cv2.resize(frame, size, dst=self.image_processor.get_buffer('preview', (size[1], size[0], 3)))
+        if not self.headless:
+            cv2.imshow(self.window_name, small)
+        if self.stream:
+            ok, jpeg = cv2.imencode('.jpg', small, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+            if ok:
+                self.mqtt_handler.publish_preview(jpeg.tobytes(), self.topic)
+
+    def poll_key(self):
+        if self.headless:
+            #nothing throttles the loop without waitKey, so yield the CPU briefly
+            time.sleep(0.005)
+            return None
+        return cv2.waitKey(1) & 0xFF
+
+    def close(self):
+        if not self.headless:
+            cv2.destroyAllWindows()
@@ -0,0 +1,52 @@
+from collections import deque
+import numpy as np
+from src.log import get_logger
+
+log = get_logger('stabilizer')
+
+class WeightStabilizer:
+    #fires once per placement, when the last stable_readings readings above threshold.weight agree within
+    #stable_stddev, and re-arms only after the weight falls back to rearm_weight
+    def __init__(self, config):
+        self.config = config
+        self.readings = deque(maxlen=self.window)
+        self.armed = True
+
+    @property
+    def threshold(self):
+        #read on every reading so a config reload applies immediately
+        return self.config['threshold']['weight']
+
+    @property
+    def window(self):
+        return max(1, self.config['threshold'].get('stable_readings', 1))
+
+    @property
+    def max_stddev(self):
+        return self.config['threshold'].get('stable_stddev', 0.05)
+
+    @property
+    def rearm_weight(self):
+        return self.config['threshold'].get('rearm_weight', self.threshold)
+
+    def add(self, weight, timestamp):
+        #returns (settled weight, time of the reading it settled on) once per placement, otherwise None
+        if weight <= self.rearm_weight:
+            if not self.armed:
+                log.info("Scale emptied (%s), ready for the next placement", weight)
+            self.armed = True
+            self.readings.clear()
+            return None
+        if not self.armed or weight <= self.threshold:
+            return None
+
+        self.readings.append((weight, timestamp))
+        if len(self.readings) < self.window:
+            return None
+        weights = np.array([reading for reading, _ in self.readings])
+        if weights.std() > self.max_stddev:
+            return None
+
+        self.armed = False
+        self.readings.clear()
+        return float(weights.mean()), timestamp
@@ -0,0 +1,38 @@
+import threading
+import time
+from contextlib import contextmanager
+
+class StartupProfiler:
+    def __init__(self, start_time=None):
+        self.start_time = start_time if start_time is not None else time.perf_counter()
+        self.phases = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        #records how long a startup phase took and on which thread it ran
+        begin = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            with self._lock:
+                self.phases.append((name, threading.current_thread().name,
+                                    begin - self.start_time, end - begin))
+
+    def mark(self, name):
+        with self._lock:
+            self.phases.append((name, threading.current_thread().name,
+                                time.perf_counter() - self.start_time, 0.0))
+
+    def elapsed(self):
+        return time.perf_counter() - self.start_time
+
+    def report(self):
+        with self._lock:
+            phases = sorted(self.phases, key=lambda phase: phase[2])
+        lines = ["Startup profile:", f"  {'phase':<28}{'thread':<16}{'start (s)':>10}{'took (s)':>10}"]
+        for name, thread, started, took in phases:
+            lines.append(f"  {name:<28}{thread:<16}{started:>10.3f}{took:>10.3f}")
+        lines.append(f"  {'total':<28}{'':<16}{'':>10}{self.elapsed():>10.3f}")
+        return "\n".join(lines)
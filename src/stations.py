@@ -0,0 +1,174 @@
+import time
+from datetime import datetime
+from src.camera import Camera
+from src.detector import Tracker
+from src.image_processing import ImageProcessor
+from src.inference_pool import TriggerDropped
+from src.log import get_logger
+from src.metrics import counter, histogram
+from src.motion import MotionGate
+from src.preview import Preview
+
+log = get_logger('stations')
+ROI_SECONDS = histogram('smart_scale_roi_seconds', 'Time to cut and mask the ROI out of one frame', ['station'])
+MOTION_SKIPPED = counter('smart_scale_motion_skipped_frames_total', 'Tracking frames skipped because the ROI was static', ['station'])
+TRACK_CROSSINGS = counter('smart_scale_track_crossings_total', 'Tracked birds crossing the ROI circle', ['station', 'direction'])
+
+class StationConfig:
+    #one station's view of the shared config, its own keys override the top level sections
+    def __init__(self, config, index):
+        self.config = config
+        self.index = index
+
+    @property
+    def overrides(self):
+        #looked up on every access so hot-reloaded station values apply immediately
+        return self.config['stations'][self.index]
+
+    @property
+    def station_id(self):
+        return self.overrides['id']
+
+    def __getitem__(self, section):
+        values = dict(self.config[section])
+        values.update(self.overrides.get(section, {}))
+        if section == 'mqtt' and 'topic_preview' not in self.overrides.get('mqtt', {}):
+            #each station streams its own preview, websocket_server serves it at /preview?station=<id>
+            values['topic_preview'] = f"{values.get('topic_preview', 'smart_scale/preview')}/{self.station_id}"
+        return values
+
+    def __contains__(self, section):
+        return section in self.config
+
+    def get(self, section, default=None):
+        return self[section] if section in self.config else default
+
+    def reload_if_changed(self):
+        return self.config.reload_if_changed()
+
+def load_stations(config):
+    #(station id, config) pairs, a config without a stations list is a single station named by mysql.device_id
+    if 'stations' not in config:
+        return [(config['mysql'].get('device_id', 'scale-1'), config)]
+    return [(station['id'], StationConfig(config, i)) for i, station in enumerate(config['stations'])]
+
+class Station:
+    #the per-scale parts of the pipeline, the model, database and image writer are shared between stations
+    def __init__(self, station_id, config, mqtt_handler, headless=False):
+        self.id = station_id
+        self.config = config
+        self.mqtt_handler = mqtt_handler
+        self.camera = Camera(config)
+        self.image_processor = ImageProcessor(config)
+        self.preview = Preview(mqtt_handler, self.image_processor, config,
+                               name=station_id if isinstance(config, StationConfig) else None, headless=headless)
+        self.frame = None
+        self.center, self.radius, self.mask = None, None, None
+        #continuous tracking, one frame in flight at a time so the tracker sees frames in order
+        self.tracking = (config.get('tracking') or {}).get('enabled', False)
+        #the tracker has to see birds outside the circle to notice them crossing it, so it looks margin radii further
+        self.tracking_margin = (config.get('tracking') or {}).get('margin', 1.0)
+        self.tracker = None
+        self.tracking_future = None
+        self.track_counts = None
+        #frames where nothing moved inside the ROI keep the previous tracking result instead of being inferred
+        self.motion = MotionGate(self.image_processor, config)
+
+    @property
+    def topic_weight(self):
+        return self.config['mqtt']['topic_weight']
+
+    def initialize(self):
+        self.camera.initialize()
+        self.update_roi()
+
+    def update_roi(self):
+        frame_width, frame_height = self.camera.get_dimensions()
+        self.center, self.radius = self.image_processor.get_roi_params(frame_width, frame_height)
+        self.mask = self.image_processor.create_circular_mask((frame_height, frame_width), self.center, self.radius)
+        if self.tracking:
+            if self.tracker is None:
+                self.tracker = Tracker(self.center, self.radius, self.config)
+            self.tracker.set_roi(self.center, self.radius)
+
+    def read(self):
+        self.frame = self.camera.get_frame()
+        return self.frame
+
+    def show_preview(self):
+        #the preview path reuses its buffers, and is skipped entirely between preview ticks
+        if self.preview.due():
+            display_frame = self.image_processor.draw_roi(self.frame, self.center, self.radius,
+                                                          out=self.image_processor.get_buffer('display', self.frame.shape))
+            if self.tracker is not None and self.track_counts is not None:
+                self.image_processor.draw_tracks(display_frame, self.tracker.tracks(), self.track_counts)
+            self.preview.show(display_frame)
+
+    def trigger_frames(self, trigger_time, vote_frames):
+        #returns the full frames, their ROIs, the ROI offset and the index of the frame closest to the trigger
+        trigger_frames, reference_index = [self.frame], 0
+        if self.camera.threaded:
+            #count the frames captured when the weight arrived, not the one read next
+            captured = self.camera.get_frames_around(trigger_time, vote_frames)
+            trigger_frames = [captured_frame for captured_frame, _, _ in captured]
+            capture_times = [capture_time for _, _, capture_time in captured]
+            reference_index = min(range(len(captured)), key=lambda i: abs(capture_times[i] - trigger_time))
+        #the count path never consults the motion gate, its reference stays the last frame the tracker was given
+        rois, offset = self.rois(trigger_frames)
+        return trigger_frames, rois, offset, reference_index
+
+    def rois(self, frames):
+        #newly allocated ROI images and their offset in the full frame
+        rois, offset = [], (0, 0)
+        roi_seconds = ROI_SECONDS.labels(self.id)
+        for frame in frames:
+            start = time.perf_counter()
+            if self.image_processor.roi_mode == 'crop':
+                roi, offset = self.image_processor.get_roi_crop(frame, self.mask, self.center, self.radius)
+            else:
+                roi = self.image_processor.get_roi(frame, self.mask)
+            roi_seconds.observe(time.perf_counter() - start)
+            rois.append(roi)
+        return rois, offset
+
+    @property
+    def tracking_radius(self):
+        return int(self.radius * (1 + self.tracking_margin))
+
+    def update_tracking(self, inference_pool, mysql_handler=None):
+        #feeds the tracker the last finished frame and submits the newest one
+        if self.tracking_future is not None:
+            if not self.tracking_future.done():
+                return
+            try:
+                result = self.tracking_future.result()
+            except TriggerDropped:
+                #the frame was never inferred, so do not let it hide changes from the next one
+                self.motion.reset()
+            except Exception as e:
+                log.error("Tracking inference failed on %s: %s", self.id, e)
+            else:
+                previous = self.track_counts or {'entered': 0, 'left': 0}
+                counts = self.tracker.update(result.results[0])
+                if counts != self.track_counts:
+                    log.info("Tracking %s: %d entered, %d left, %d inside, %d seen", self.id,
+                             counts['entered'], counts['left'], counts['inside'], counts['unique'])
+                    self.mqtt_handler.publish_tracking(counts, self.id)
+                entered, left = counts['entered'] - previous['entered'], counts['left'] - previous['left']
+                if entered or left:
+                    TRACK_CROSSINGS.labels(self.id, 'in').inc(entered)
+                    TRACK_CROSSINGS.labels(self.id, 'out').inc(left)
+                    if mysql_handler is not None:
+                        mysql_handler.log_crossings(datetime.now(), entered, left, self.id)
+                self.track_counts = counts
+            self.tracking_future = None
+        if not self.motion.changed(self.frame, self.center, self.tracking_radius):
+            MOTION_SKIPPED.labels(self.id).inc()
+            return
+        #unmasked, the pool maps the boxes back to full frame coordinates where the tracker tests the circle
+        roi, offset = self.image_processor.get_crop(self.frame, self.center, self.tracking_radius)
+        self.tracking_future = inference_pool.submit([roi], None, time.monotonic(), None, offset, 0, self.id, mode='track')
+
+    def close(self):
+        self.camera.release()
+        self.preview.close()
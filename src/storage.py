@@ -0,0 +1,133 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from src.log import get_logger
+
+log = get_logger('storage')
+
+THUMBNAIL_SUFFIX = "_thumb"
+
+def thumbnail_path(image_path):
+    stem, ext = os.path.splitext(image_path)
+    return f"{stem}{THUMBNAIL_SUFFIX}{ext}"
+
+def image_for_thumbnail(path):
+    #maps a thumbnail back to the image it belongs to, other paths map to themselves
+    stem, ext = os.path.splitext(path)
+    if stem.endswith(THUMBNAIL_SUFFIX):
+        return stem[:-len(THUMBNAIL_SUFFIX)] + ext
+    return path
+
+def shard_directory(output_dir, when):
+    return os.path.join(output_dir, when.strftime("%Y"), when.strftime("%m"), when.strftime("%d"))
+
+class RetentionManager:
+    #keeps output_dir under max_size_mb and max_age_days by evicting the least recently used images
+    def __init__(self, output_dir, max_size_mb=0, max_age_days=0):
+        self.output_dir = output_dir
+        self.max_bytes = int(max_size_mb * 1024 * 1024)
+        self.max_age = max_age_days * 86400
+        #image path -> [bytes including its thumbnail, last access time], least recently used first
+        self._files = OrderedDict()
+        self._total = 0
+        self._lock = threading.Lock()
+        self._scanned = threading.Event()
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0 or self.max_age > 0
+
+    def start(self):
+        #the first scan of a full SD card is slow, so it runs in the background
+        if self.enabled:
+            threading.Thread(target=self.scan, name="retention-scan", daemon=True).start()
+
+    def scan(self):
+        found = {}
+        for root, _, filenames in os.walk(self.output_dir):
+            for filename in filenames:
+                if filename.endswith(".tmp"):
+                    continue
+                path = os.path.join(root, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entry = found.setdefault(image_for_thumbnail(path), [0, 0.0])
+                entry[0] += stat.st_size
+                entry[1] = max(entry[1], stat.st_atime, stat.st_mtime)
+
+        with self._lock:
+            #files added while scanning are newer than anything found on disk
+            added = self._files
+            self._files = OrderedDict(sorted(found.items(), key=lambda item: item[1][1]))
+            for path, entry in added.items():
+                self._files.pop(path, None)
+                self._files[path] = entry
+            self._total = sum(entry[0] for entry in self._files.values())
+        self._scanned.set()
+        self.enforce()
+
+    def add(self, path, size):
+        with self._lock:
+            entry = self._files.pop(path, [0, 0.0])
+            self._total += size
+            entry[0] += size
+            entry[1] = time.time()
+            self._files[path] = entry
+        self.enforce()
+
+    def touch(self, path):
+        with self._lock:
+            entry = self._files.get(image_for_thumbnail(path))
+            if entry is not None:
+                entry[1] = time.time()
+                self._files.move_to_end(image_for_thumbnail(path))
+
+    def _last_access(self, path, recorded):
+        #the image server marks served files by bumping their atime, so check the disk before evicting
+        try:
+            return max(recorded, os.stat(path).st_atime)
+        except OSError:
+            return recorded
+
+    def enforce(self):
+        if not self.enabled or not self._scanned.is_set():
+            return
+        now = time.time()
+        while True:
+            with self._lock:
+                if not self._files:
+                    return
+                path, (size, last_access) = next(iter(self._files.items()))
+                over_size = self.max_bytes and self._total > self.max_bytes
+                too_old = self.max_age and now - last_access > self.max_age
+                if not (over_size or too_old):
+                    return
+                current_access = self._last_access(path, last_access)
+                if current_access > last_access and not (self.max_age and now - current_access > self.max_age):
+                    #recently served, give it another round at the back of the queue
+                    self._files.move_to_end(path)
+                    self._files[path][1] = current_access
+                    continue
+                del self._files[path]
+                self._total -= size
+            self._remove(path)
+
+    def _remove(self, path):
+        for file_path in (path, thumbnail_path(path)):
+            try:
+                os.remove(file_path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                log.warning("Failed to remove %s: %s", file_path, e)
+        #drop day, month and year directories once they are empty
+        directory = os.path.dirname(path)
+        while os.path.abspath(directory) != os.path.abspath(self.output_dir):
+            try:
+                os.rmdir(directory)
+            except OSError:
+                break
+            directory = os.path.dirname(directory)
@@ -0,0 +1,106 @@
+import copy
+import logging
+import os
+import pytest
+import yaml
+from src.config import Config, ConfigError, apply_env_overrides, validate
+
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'config.yaml')
+
+@pytest.fixture
+def data():
+    with open(CONFIG_PATH) as file:
+        return yaml.safe_load(file)
+
+def test_shipped_config_is_valid(data):
+    validate(data)
+
+def test_sections_left_out_fall_back_to_defaults(data):
+    #a config.yaml from before the inference and display sections existed
+    for section in ('inference', 'display', 'tracking', 'motion', 'metrics', 'logging'):
+        del data[section]
+    validate(data)
+    assert data['inference'] == {} and data['display'] == {}
+
+def test_env_overrides_are_parsed_as_yaml():
+    data = apply_env_overrides({'yolo': {'conf_threshold': 0.8}}, {
+        'SMART_SCALE__YOLO__CONF_THRESHOLD': '0.6',
+        'SMART_SCALE__DISPLAY__HEADLESS': 'true',
+        'OTHER__YOLO__CONF_THRESHOLD': '0.1',
+    })
+    assert data == {'yolo': {'conf_threshold': 0.6}, 'display': {'headless': True}}
+
+def test_env_override_needs_section_and_key():
+    with pytest.raises(ConfigError):
+        apply_env_overrides({}, {'SMART_SCALE__YOLO': '1'})
+
+@pytest.mark.parametrize('section, key, value, message', [
+    ('mqtt', 'port', '1883', "'mqtt.port' has invalid value"),
+    ('display', 'preview_fps', True, "'display.preview_fps' has invalid value"),
+    ('yolo', 'conf_threshold', 1.5, "'yolo.conf_threshold' must be between 0 and 1"),
+    ('threshold', 'rearm_weight', 50, "'threshold.rearm_weight' must not be above"),
+    ('mqtt', 'qos', 3, "'mqtt.qos' must be 0, 1 or 2"),
+    ('tracking', 'margin', -1, "'tracking.margin' must not be negative"),
+])
+def test_invalid_values_are_rejected(data, section, key, value, message):
+    data[section][key] = value
+    with pytest.raises(ConfigError, match=message):
+        validate(data)
+
+def test_missing_required_key_is_reported(data):
+    del data['mqtt']['broker']
+    with pytest.raises(ConfigError, match="missing key 'mqtt.broker'"):
+        validate(data)
+
+def test_stations_are_validated_on_their_merged_view(data):
+    data['stations'] = [{'id': 'a', 'mqtt': {'topic_weight': 'scale/a'}},
+                        {'id': 'b', 'mqtt': {'topic_weight': 'scale/b'}, 'threshold': {'weight': 20}}]
+    validate(copy.deepcopy(data))
+    data['stations'][1]['yolo'] = {'conf_threshold': 0.5}
+    with pytest.raises(ConfigError, match="station 'b' cannot override 'yolo'"):
+        validate(copy.deepcopy(data))
+    del data['stations'][1]['yolo']
+    data['stations'][1]['roi'] = {'radius_fraction': 0.9}
+    with pytest.raises(ConfigError, match="station 'b': 'roi.radius_fraction'"):
+        validate(data)
+
+def test_stations_need_their_own_weight_topic(data):
+    data['stations'] = [{'id': 'a'}, {'id': 'b'}]
+    with pytest.raises(ConfigError, match="stations 'a' and 'b' share weight topic"):
+        validate(data)
+
+class Collect(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+def test_reload_applies_hot_keys_and_warns_once_about_the_rest(data, tmp_path):
+    path = tmp_path / 'config.yaml'
+    path.write_text(yaml.safe_dump(data))
+    config = Config(str(path))
+    port = data['mqtt']['port']
+    data['threshold']['weight'] = 12
+    data['mqtt']['port'] = port + 1
+    path.write_text(yaml.safe_dump(data))
+    handler = Collect()
+    logger = logging.getLogger('smart_scale.config')
+    logger.addHandler(handler)
+    try:
+        assert config.reload() == ['threshold.weight']
+        assert config.reload() == []
+    finally:
+        logger.removeHandler(handler)
+    assert config['threshold']['weight'] == 12 and config['mqtt']['port'] == port
+    assert handler.messages.count("Config change to mqtt.port needs a restart to take effect") == 1
+
+def test_reload_keeps_values_when_the_file_is_invalid(data, tmp_path):
+    path = tmp_path / 'config.yaml'
+    path.write_text(yaml.safe_dump(data))
+    config = Config(str(path))
+    data['yolo']['conf_threshold'] = 2
+    path.write_text(yaml.safe_dump(data))
+    assert config.reload() == []
+    assert config['yolo']['conf_threshold'] == 0.8
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+from src.detector import Detector
+from src.inference_backends import Boxes, Results
+
+def make_detector(monkeypatch, vote_method):
+    #vote_count never touches the model
+    monkeypatch.setattr('src.detector.create_backend', lambda *args: None)
+    return Detector({'yolo': {'model_path': 'model.onnx', 'conf_threshold': 0.5, 'iou_threshold': 0.7, 'classes': [0]},
+                     'inference': {'vote_method': vote_method}})
+
+def result(count, conf=0.9):
+    data = np.array([[i * 50, 0, i * 50 + 40, 40, conf, 0] for i in range(count)], dtype=np.float32)
+    return Results(Boxes(data.reshape(-1, 6)), (480, 640))
+
+def vote(detector, counts, reference_index=0, confs=None):
+    confs = confs or [0.9] * len(counts)
+    return detector.vote_count([result(count, conf) for count, conf in zip(counts, confs)], reference_index)
+
+def test_median_rounds_half_up(monkeypatch):
+    detector = make_detector(monkeypatch, 'median')
+    assert vote(detector, [2, 3, 3, 9])[0] == 3
+    assert vote(detector, [2, 3])[0] == 3
+
+def test_mode_breaks_ties_towards_the_median(monkeypatch):
+    detector = make_detector(monkeypatch, 'mode')
+    assert vote(detector, [4, 4, 1, 5])[0] == 4
+    assert vote(detector, [2, 2, 3, 3, 5])[0] == 3
+    assert vote(detector, [1, 1, 2, 2, 0])[0] == 1
+
+def test_confidence_weights_frames_by_mean_box_confidence(monkeypatch):
+    detector = make_detector(monkeypatch, 'confidence')
+    #an empty frame weighs in as a zero at the confidence threshold: 4 * 0.9 / 1.4 = 2.57
+    assert vote(detector, [4, 0], confs=[0.9, 0.9])[0] == 3
+    assert vote(detector, [4, 1], confs=[0.2, 0.9])[0] == 2
+
+def test_best_index_is_the_matching_frame_nearest_the_trigger(monkeypatch):
+    detector = make_detector(monkeypatch, 'median')
+    assert vote(detector, [3, 5, 3], reference_index=2) == (3, 2)
+    assert vote(detector, [3, 5, 3], reference_index=1) == (3, 0)
+    #the right count wins over being close to the trigger
+    assert vote(detector, [2, 6, 4], reference_index=0) == (4, 2)
+    #no frame shows the voted 3, both are one off and the one nearer the trigger is picked
+    assert vote(detector, [2, 4], reference_index=1) == (3, 1)
+
+def test_unknown_vote_method_is_rejected(monkeypatch):
+    detector = make_detector(monkeypatch, 'mean')
+    with pytest.raises(ValueError):
+        vote(detector, [1, 2])
@@ -0,0 +1,59 @@
+import json
+from datetime import date, timedelta
+from src.fanout import ReplayBuffer
+
+def event(day, count=2, weight=4.0):
+    return {'type': 'data', 'datetime': f"{day} 12:00:00", 'total_count': count, 'total_weight': weight}
+
+def parse(messages):
+    return [json.loads(message) for message in messages]
+
+def test_snapshot_replays_only_messages_after_since():
+    today = date.today().isoformat()
+    replay = ReplayBuffer(size=10, epoch=1)
+    for _ in range(3):
+        replay.add(event(today))
+    snapshot, *messages = parse(replay.snapshot(since=1, epoch=1))
+    assert snapshot['seq'] == 3 and snapshot['complete']
+    assert [message['seq'] for message in messages] == [2, 3]
+    assert snapshot['totals'] == {'events': 3, 'total_count': 6, 'total_weight': 12.0, 'average_weight': 2.0}
+
+def test_resume_from_another_epoch_replays_everything():
+    #a restarted server has published as many messages as the client saw, only the epoch tells them apart
+    today = date.today().isoformat()
+    replay = ReplayBuffer(size=10, epoch=2)
+    for _ in range(3):
+        replay.add(event(today))
+    _, *messages = parse(replay.snapshot(since=2, epoch=1))
+    assert [message['seq'] for message in messages] == [1, 2, 3]
+    _, *messages = parse(replay.snapshot(since=2))
+    assert len(messages) == 3
+
+def test_snapshot_reports_incomplete_when_buffer_overflowed():
+    today = date.today().isoformat()
+    replay = ReplayBuffer(size=2, epoch=1)
+    for _ in range(5):
+        replay.add(event(today))
+    snapshot, *messages = parse(replay.snapshot(since=1, epoch=1))
+    assert not snapshot['complete']
+    assert [message['seq'] for message in messages] == [4, 5]
+
+def test_totals_roll_over_without_new_events():
+    yesterday = (date.today() - timedelta(days=1)).isoformat()
+    replay = ReplayBuffer(epoch=1)
+    replay.add(event(yesterday))
+    snapshot = parse(replay.snapshot())[0]
+    assert snapshot['date'] == date.today().isoformat()
+    assert snapshot['totals']['events'] == 0
+    #a late event from yesterday does not count toward today
+    replay.add(event(yesterday))
+    assert parse(replay.snapshot())[0]['totals']['events'] == 0
+
+def test_seed_from_daily_rollups():
+    today = date.today()
+    replay = ReplayBuffer(epoch=1)
+    replay.seed(today, [{'events': 2, 'total_count': 5, 'total_weight': 10.0},
+                        {'events': 1, 'total_count': 3, 'total_weight': 6.0}])
+    replay.add(event(today.isoformat()))
+    totals = parse(replay.snapshot())[0]['totals']
+    assert totals == {'events': 4, 'total_count': 10, 'total_weight': 20.0, 'average_weight': 2.0}
@@ -0,0 +1,69 @@
+import os
+import cv2
+import numpy as np
+import pytest
+from src.image_cache import ImageCache, parse_range, variant_width
+
+def test_parse_range():
+    assert parse_range("bytes=0-99", 1000) == (0, 99)
+    assert parse_range("bytes=900-", 1000) == (900, 999)
+    assert parse_range("bytes=-100", 1000) == (900, 999)
+    assert parse_range("bytes=-2000", 1000) == (0, 999)
+    #an end past the file is cut to the last byte
+    assert parse_range("bytes=500-5000", 1000) == (500, 999)
+
+def test_parse_range_ignores_what_it_cannot_serve():
+    assert parse_range(None, 1000) is None
+    assert parse_range("items=0-10", 1000) is None
+    assert parse_range("bytes=0-10,20-30", 1000) is None
+    assert parse_range("bytes=a-b", 1000) is None
+
+def test_parse_range_rejects_unsatisfiable_ranges():
+    with pytest.raises(ValueError):
+        parse_range("bytes=1000-", 1000)
+    with pytest.raises(ValueError):
+        parse_range("bytes=50-10", 1000)
+
+def test_variant_width_rounds_up():
+    assert variant_width("100") == 160
+    assert variant_width("320") == 320
+    assert variant_width("5000") is None
+    assert variant_width("-1") is None
+    assert variant_width("wide") is None
+
+def write_image(path, width=640, height=480):
+    cv2.imwrite(str(path), np.full((height, width, 3), 128, dtype=np.uint8))
+    return str(path)
+
+def test_get_caches_until_the_file_changes(tmp_path):
+    path = write_image(tmp_path / "a.jpg")
+    cache = ImageCache()
+    first = cache.get(path)
+    assert cache.get(path) is first
+    assert first.content_type == "image/jpeg"
+    assert first.not_modified(first.etag, None) and first.not_modified('"other", ' + first.etag, None)
+    assert not first.not_modified('"other"', None)
+    assert first.not_modified(None, first.last_modified)
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    second = cache.get(path)
+    assert second is not first and second.etag != first.etag
+
+def test_resized_variant_has_its_own_entry(tmp_path):
+    path = write_image(tmp_path / "a.jpg")
+    cache = ImageCache()
+    original, small = cache.get(path), cache.get(path, 160)
+    assert small.etag != original.etag
+    assert cv2.imdecode(np.frombuffer(small.body, dtype=np.uint8), cv2.IMREAD_COLOR).shape[:2] == (120, 160)
+    assert len(cache) == 2
+
+def test_least_recently_used_image_is_evicted(tmp_path):
+    paths = [write_image(tmp_path / f"{i}.jpg") for i in range(3)]
+    size = len(ImageCache().get(paths[0]).body)
+    cache = ImageCache(max_bytes=size * 2)
+    first = cache.get(paths[0])
+    cache.get(paths[1])
+    cache.get(paths[0])
+    cache.get(paths[2])
+    assert len(cache) == 2
+    assert cache.get(paths[0]) is first
@@ -0,0 +1,51 @@
+import numpy as np
+from src.inference_backends import letterbox, non_max_suppression, postprocess
+
+def head(*boxes, num_classes=2):
+    #a raw YOLOv8 output of shape (4 + num_classes, N), boxes as (cx, cy, w, h, score, class) in letterbox pixels
+    output = np.zeros((4 + num_classes, len(boxes)), dtype=np.float32)
+    for i, (cx, cy, w, h, score, cls) in enumerate(boxes):
+        output[:4, i] = cx, cy, w, h
+        output[4 + cls, i] = score
+    return output
+
+def test_letterbox_keeps_aspect_ratio_and_centers_the_frame():
+    frame = np.zeros((480, 640, 3), dtype=np.uint8)
+    padded, ratio, pad = letterbox(frame, 320)
+    assert padded.shape == (320, 320, 3)
+    assert ratio == 0.5 and pad == (0, 40)
+    assert (padded[:40] == 114).all() and (padded[280:] == 114).all() and (padded[40:280] == 0).all()
+
+def test_non_max_suppression_keeps_the_best_of_overlapping_boxes():
+    boxes = np.array([[0, 0, 10, 10], [1, 1, 11, 11], [50, 50, 60, 60]], dtype=np.float32)
+    scores = np.array([0.8, 0.9, 0.7], dtype=np.float32)
+    assert non_max_suppression(boxes, scores, 0.5).tolist() == [1, 2]
+    assert non_max_suppression(boxes, scores, 0.9).tolist() == [1, 0, 2]
+
+def test_postprocess_maps_boxes_back_to_the_frame():
+    #a 640x480 frame letterboxed to 320: scaled by 0.5 and shifted down by 40
+    frame_shape, ratio, pad = (480, 640), 0.5, (0, 40)
+    output = head((75, 110, 50, 40, 0.9, 0),     #frame box (100, 100, 200, 180)
+                  (76, 111, 50, 40, 0.8, 0),     #duplicate, suppressed
+                  (75, 110, 50, 40, 0.85, 1),    #same place but another class, kept
+                  (200, 200, 20, 20, 0.2, 0),    #below the threshold
+                  (315, 270, 20, 20, 0.9, 0))    #runs past the right edge, clipped
+    results = postprocess(output, frame_shape, ratio, pad, 0.5, 0.7)
+    #kept boxes come out by score, sorted here by position and class to compare
+    data = results.boxes.data[np.lexsort((results.boxes.cls, results.boxes.xyxy[:, 0]))]
+    np.testing.assert_allclose(data, [[100, 100, 200, 180, 0.9, 0],
+                                      [100, 100, 200, 180, 0.85, 1],
+                                      [610, 440, 640, 480, 0.9, 0]], atol=1e-5)
+    assert results.orig_shape == frame_shape
+
+def test_postprocess_filters_classes_and_handles_no_detections():
+    output = head((75, 110, 50, 40, 0.9, 0), (175, 110, 50, 40, 0.9, 1))
+    results = postprocess(output, (480, 640), 0.5, (0, 40), 0.5, 0.7, classes=[1])
+    assert results.boxes.cls.tolist() == [1]
+    empty = postprocess(output, (480, 640), 0.5, (0, 40), 0.95, 0.7)
+    assert empty.boxes.data.shape == (0, 6)
+
+def test_translate_moves_crop_boxes_into_the_frame():
+    output = head((75, 110, 50, 40, 0.9, 0))
+    results = postprocess(output, (480, 640), 0.5, (0, 40), 0.5, 0.7).translate(300, 20)
+    np.testing.assert_allclose(results.boxes.xyxy[0], [400, 120, 500, 200], atol=1e-5)
@@ -0,0 +1,47 @@
+import logging
+from src.log import RateLimitFilter
+
+class Collect(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+def make_logger(rate_limit):
+    handler = Collect()
+    handler.addFilter(rate_limit)
+    logger = logging.getLogger('smart_scale_test.rate_limit')
+    logger.handlers = [handler]
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    return logger, handler.records
+
+def test_quiet_call_site_is_reported_when_its_window_closes(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr('src.log.time.monotonic', lambda: now[0])
+    logger, records = make_logger(RateLimitFilter(burst=2, interval=10.0))
+    for i in range(5):
+        logger.warning("retrying %d", i)
+    assert [record.getMessage() for record in records] == ["retrying 0", "retrying 1"]
+    #the site itself never logs again, any other message closes its window
+    now[0] += 10.0
+    logger.info("something else")
+    summary = records[2]
+    assert summary.suppressed == 3 and summary.levelno == logging.WARNING
+    assert "retrying %d" in summary.getMessage()
+    assert records[3].getMessage() == "something else"
+
+def test_flush_reports_open_windows():
+    rate_limit = RateLimitFilter(burst=1, interval=60.0)
+    logger, records = make_logger(rate_limit)
+    logger.warning("busy")
+    logger.warning("busy")
+    logger.error("errors are never held back")
+    logger.error("errors are never held back")
+    assert len(records) == 3
+    rate_limit.flush()
+    assert records[-1].suppressed == 1
+    rate_limit.flush()
+    assert len(records) == 4
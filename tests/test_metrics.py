@@ -0,0 +1,34 @@
+from src.metrics import Counter, Gauge, Histogram, Registry
+
+def test_histogram_buckets_include_their_bound():
+    histogram = Histogram('test_seconds', 'Test', buckets=(0.1, 1.0))
+    for value in (0.1, 0.5, 1.0, 2.0):
+        histogram.observe(value)
+    lines = histogram.render()
+    assert 'test_seconds_bucket{le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{le="1.0"} 3' in lines
+    assert 'test_seconds_bucket{le="+Inf"} 4' in lines
+    assert 'test_seconds_sum 3.6' in lines
+    assert 'test_seconds_count 4' in lines
+
+def test_label_values_are_escaped():
+    counter = Counter('test_total', 'Test', ['station'])
+    counter.labels('a"b\\c\nd').inc(2)
+    assert counter.render()[2] == 'test_total{station="a\\"b\\\\c\\nd"} 2'
+
+def test_labelled_histogram_puts_le_last():
+    histogram = Histogram('test_seconds', 'Test', ['station'], buckets=(1.0,))
+    histogram.labels('s1').observe(0.5)
+    assert 'test_seconds_bucket{station="s1",le="1.0"} 1' in histogram.render()
+
+def test_registry_renders_unlabelled_metrics_from_the_start():
+    registry = Registry()
+    registry.counter('test_total', 'Things counted')
+    registry.gauge('test_depth', 'Queue depth').set_function(lambda: 7)
+    assert registry.render() == ("# HELP test_total Things counted\n# TYPE test_total counter\ntest_total 0\n"
+                                 "# HELP test_depth Queue depth\n# TYPE test_depth gauge\ntest_depth 7\n")
+
+def test_failing_gauge_function_is_left_out():
+    gauge = Gauge('test_depth', 'Test')
+    gauge.set_function(lambda: 1 / 0)
+    assert gauge.render() == ['# HELP test_depth Test', '# TYPE test_depth gauge']
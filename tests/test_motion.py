@@ -0,0 +1,31 @@
+import numpy as np
+from src.image_processing import ImageProcessor
+from src.motion import MotionGate
+
+CONFIG = {'roi': {'radius_fraction': 0.4}, 'motion': {'enabled': True, 'max_interval': 60.0}}
+
+def make_gate():
+    return MotionGate(ImageProcessor(CONFIG), CONFIG)
+
+def with_blob(frame, x, y):
+    frame = frame.copy()
+    frame[y - 20:y + 20, x - 20:x + 20] = 255
+    return frame
+
+def test_static_frames_are_skipped_and_motion_inside_is_not():
+    gate, frame = make_gate(), np.zeros((240, 320, 3), dtype=np.uint8)
+    assert gate.changed(frame, (160, 120), 96)
+    assert not gate.changed(frame, (160, 120), 96)
+    assert gate.changed(with_blob(frame, 160, 120), (160, 120), 96)
+    assert gate.skipped == 1
+
+def test_motion_outside_the_circle_is_ignored():
+    gate, frame = make_gate(), np.zeros((240, 320, 3), dtype=np.uint8)
+    gate.changed(frame, (160, 120), 96)
+    assert not gate.changed(with_blob(frame, 20, 20), (160, 120), 96)
+
+def test_reset_infers_the_next_frame():
+    gate, frame = make_gate(), np.zeros((240, 320, 3), dtype=np.uint8)
+    gate.changed(frame, (160, 120), 96)
+    gate.reset()
+    assert gate.changed(frame, (160, 120), 96)
@@ -0,0 +1,105 @@
+import json
+import os
+import threading
+import pytest
+
+pytest.importorskip('paho.mqtt.client')
+from src.mqtt_handler import MQTTHandler
+
+class PublishInfo:
+    def __init__(self, rc):
+        self.rc = rc
+
+class FakeClient:
+    #stands in for the paho client, accepts the first accept messages and then reports no connection
+    def __init__(self, accept=None):
+        self.accept = accept
+        self.messages = []
+
+    def publish(self, topic, payload, qos=0):
+        if self.accept is not None and len(self.messages) >= self.accept:
+            return PublishInfo(4)
+        self.messages.append(json.loads(payload))
+        return PublishInfo(0)
+
+def make_handler(tmp_path, client, batch_size=1):
+    config = {
+        'mqtt': {
+            'broker': 'localhost',
+            'port': 1883,
+            'topic_weight': 'smart_scale/weight',
+            'topic_data': 'smart_scale/data',
+            'batch_size': batch_size,
+            'spool_path': str(tmp_path / 'spool.jsonl'),
+        },
+        'threshold': {'weight': 5},
+    }
+    handler = MQTTHandler(config)
+    handler.client = client
+    handler.connected.set()
+    return handler
+
+def write_spool(handler, lines):
+    with open(handler.spool_path, 'w') as file:
+        file.write("".join(lines))
+
+def event(i):
+    return {'datetime': f"2026-10-01 12:00:0{i}", 'total_weight': 1.0, 'total_count': i, 'image_path': None}
+
+def test_replay_sends_spooled_events_and_removes_the_spool(tmp_path):
+    handler = make_handler(tmp_path, FakeClient(), batch_size=2)
+    write_spool(handler, [json.dumps(event(i)) + "\n" for i in range(3)])
+    handler._replay_spool()
+    assert [message for batch in handler.client.messages for message in batch] == [event(i) for i in range(3)]
+    assert not os.path.exists(handler.spool_path)
+
+def test_truncated_spool_line_is_set_aside(tmp_path):
+    handler = make_handler(tmp_path, FakeClient())
+    write_spool(handler, [json.dumps(event(1)) + "\n", '{"datetime": "2026-10-01 12:0'])
+    handler._replay_spool()
+    assert handler.client.messages == [event(1)]
+    assert not os.path.exists(handler.spool_path)
+    with open(handler.bad_path) as file:
+        assert file.read() == '{"datetime": "2026-10-01 12:0\n'
+
+def test_failed_replay_keeps_only_the_unsent_events(tmp_path):
+    handler = make_handler(tmp_path, FakeClient(accept=1))
+    write_spool(handler, [json.dumps(event(i)) + "\n" for i in range(3)])
+    handler._replay_spool()
+    assert handler.client.messages == [event(0)]
+    with open(handler.spool_path) as file:
+        assert [json.loads(line) for line in file] == [event(1), event(2)]
+
+def test_crash_during_replay_keeps_the_spool(tmp_path):
+    class CrashingClient(FakeClient):
+        def publish(self, topic, payload, qos=0):
+            raise RuntimeError("killed")
+
+    handler = make_handler(tmp_path, CrashingClient())
+    lines = [json.dumps(event(i)) + "\n" for i in range(3)]
+    write_spool(handler, lines)
+    with pytest.raises(RuntimeError):
+        handler._replay_spool()
+    with open(handler.spool_path) as file:
+        assert file.readlines() == lines
+
+def test_failed_send_is_spooled_and_publisher_keeps_running(tmp_path):
+    class FlakyClient(FakeClient):
+        def publish(self, topic, payload, qos=0):
+            if not self.messages and not getattr(self, 'failed', False):
+                self.failed = True
+                raise ValueError("cannot encode")
+            return super().publish(topic, payload, qos)
+
+    handler = make_handler(tmp_path, FlakyClient())
+    handler.batch_interval = 0.05
+    handler._thread = threading.Thread(target=handler._publisher)
+    handler._thread.start()
+    handler.publish_data("2026-10-01 12:00:00", 1.0, 1, None)
+    handler.publish_data("2026-10-01 12:00:01", 2.0, 2, None)
+    handler.events.put(None)
+    handler._thread.join(5)
+    assert not handler._thread.is_alive()
+    #the failed event went to the spool and was replayed before the next one was sent
+    assert [message['total_count'] for message in handler.client.messages] == [1, 2]
+    assert not os.path.exists(handler.spool_path)
@@ -0,0 +1,135 @@
+import json
+import os
+import sqlite3
+from datetime import datetime
+import pytest
+from src.mysql_handler import MYSQLHandler
+
+def make_handler(tmp_path, sqlite_path=None):
+    config = {'mysql': {
+        'driver': 'sqlite',
+        'host': 'localhost',
+        'user': 'test',
+        'database': 'test',
+        'sqlite_path': sqlite_path or str(tmp_path / 'scale.db'),
+        'spool_path': str(tmp_path / 'spool.jsonl'),
+        'device_id': 'scale-7',
+        'batch_size': 10,
+        'flush_interval': 0.05,
+        'retry_interval': 0.05,
+    }}
+    return MYSQLHandler(config)
+
+def logged_rows(handler):
+    with sqlite3.connect(handler.sqlite_path) as conn:
+        return conn.execute("SELECT weight, count, device_id FROM detection_logs ORDER BY weight").fetchall()
+
+def test_rows_are_spooled_while_unreachable_and_replayed(tmp_path):
+    down = make_handler(tmp_path, sqlite_path=str(tmp_path / 'missing' / 'scale.db'))
+    down.start()
+    down.log_detection("2026-10-01 12:00:00", 1.0, 2, "a.jpg")
+    down.log_detection("2026-10-01 12:00:05", 2.0, 3, "b.jpg")
+    down.close()
+    with open(down.spool_path) as file:
+        assert len(file.readlines()) == 2
+
+    handler = make_handler(tmp_path)
+    handler.start()
+    handler.log_detection("2026-10-01 12:01:00", 3.0, 4, "c.jpg")
+    handler.close()
+    assert logged_rows(handler) == [(1.0, 2, 'scale-7'), (2.0, 3, 'scale-7'), (3.0, 4, 'scale-7')]
+    assert not os.path.exists(handler.spool_path)
+
+def test_truncated_spool_line_is_set_aside(tmp_path):
+    handler = make_handler(tmp_path)
+    with open(handler.spool_path, 'w') as file:
+        file.write(json.dumps(["2026-10-01 12:00:00", 1.0, 2, "a.jpg"]) + "\n")
+        file.write('["2026-10-01 12:00:05", 2.0, 3, "b.j')
+    handler.start()
+    handler.log_detection("2026-10-01 12:01:00", 3.0, 4, "c.jpg")
+    handler.close()
+    assert logged_rows(handler) == [(1.0, 2, 'scale-7'), (3.0, 4, 'scale-7')]
+    assert not os.path.exists(handler.spool_path)
+    with open(handler.bad_path) as file:
+        assert file.read() == '["2026-10-01 12:00:05", 2.0, 3, "b.j\n'
+
+def test_rejected_row_is_quarantined_and_writer_keeps_going(tmp_path):
+    handler = make_handler(tmp_path)
+    handler.connect()
+    with sqlite3.connect(handler.sqlite_path) as conn:
+        conn.execute("""CREATE TRIGGER reject_negative BEFORE INSERT ON detection_logs WHEN NEW.count < 0
+                        BEGIN SELECT RAISE(ABORT, 'negative count'); END""")
+    handler.start()
+    handler.log_detection("2026-10-01 12:00:00", 1.0, 2, "a.jpg")
+    handler.log_detection("2026-10-01 12:00:05", 2.0, -1, "b.jpg")
+    handler.log_detection("2026-10-01 12:00:10", 3.0, 4, "c.jpg")
+    handler.close()
+    assert logged_rows(handler) == [(1.0, 2, 'scale-7'), (3.0, 4, 'scale-7')]
+    assert not os.path.exists(handler.spool_path)
+    with open(handler.bad_path) as file:
+        assert [json.loads(line)[1:3] for line in file] == [[2.0, -1]]
+    with sqlite3.connect(handler.sqlite_path) as conn:
+        assert conn.execute("SELECT events, total_count FROM detection_daily").fetchall() == [(2, 6)]
+
+def test_unparseable_timestamp_is_rejected_not_retried(tmp_path):
+    handler = make_handler(tmp_path)
+    handler.start()
+    handler.log_detection("yesterday", 1.0, 2, "a.jpg")
+    handler.close()
+    assert handler._thread is None
+    assert logged_rows(handler) == []
+    assert not os.path.exists(handler.spool_path)
+    assert os.path.exists(handler.bad_path)
+
+def test_migration_assigns_existing_rows_to_the_configured_device(tmp_path):
+    handler = make_handler(tmp_path)
+    handler.device_id = "barn's scale"
+    with sqlite3.connect(handler.sqlite_path) as conn:
+        conn.execute("CREATE TABLE schema_version (version INT NOT NULL)")
+        conn.execute(handler.migrations()[0][0])
+        conn.execute("INSERT INTO schema_version (version) VALUES (1)")
+        conn.execute("INSERT INTO detection_logs (timestamp, weight, count, image_path) "
+                     "VALUES ('2026-10-01 12:00:00', 1.0, 2, 'a.jpg')")
+    handler.connect()
+    with sqlite3.connect(handler.sqlite_path) as conn:
+        assert conn.execute("SELECT device_id FROM detection_logs").fetchall() == [("barn's scale",)]
+        assert conn.execute("SELECT device_id, events FROM detection_daily").fetchall() == [("barn's scale", 1)]
+
+def test_crossings_are_summed_per_hour(tmp_path):
+    handler = make_handler(tmp_path)
+    handler.start()
+    handler.log_crossings(datetime(2026, 10, 1, 12, 5), 2, 0)
+    handler.log_crossings(datetime(2026, 10, 1, 12, 50), 1, 3)
+    handler.log_crossings(datetime(2026, 10, 1, 13, 0), 0, 1, 'scale-8')
+    handler.close()
+    handler.connect()
+    rows = handler.get_crossing_stats("2026-10-01", "2026-10-02")
+    assert [(row['device_id'], row['bucket'], row['entered'], row['exited']) for row in rows] == [
+        ('scale-7', '2026-10-01 12:00:00', 3, 3), ('scale-8', '2026-10-01 13:00:00', 0, 1)]
+
+def test_half_applied_migration_is_run_again(tmp_path):
+    #a power cut after the DDL of a version but before schema_version records it
+    handler = make_handler(tmp_path)
+    with sqlite3.connect(handler.sqlite_path) as conn:
+        conn.execute("CREATE TABLE detection_logs (id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp DATETIME,"
+                     " weight FLOAT, count INT, image_path VARCHAR(255))")
+        conn.execute("INSERT INTO detection_logs (timestamp, weight, count, image_path)"
+                     " VALUES ('2026-10-01 12:00:00', 1.5, 3, 'a.jpg')")
+        conn.execute("CREATE TABLE schema_version (version INT NOT NULL)")
+        conn.execute("INSERT INTO schema_version (version) VALUES (1)")
+    migrations = handler.migrations()
+    with sqlite3.connect(handler.sqlite_path) as conn:
+        cursor = conn.cursor()
+        for statement in migrations[1] + migrations[2]:
+            if callable(statement):
+                statement(cursor)
+            else:
+                cursor.execute(statement)
+        conn.commit()
+
+    handler.connect()
+    handler.connect()
+    with sqlite3.connect(handler.sqlite_path) as conn:
+        assert conn.execute("SELECT MAX(version) FROM schema_version").fetchone()[0] == len(migrations)
+        assert conn.execute("SELECT device_id, events, total_count FROM detection_daily").fetchall() == [('scale-7', 1, 3)]
+    assert logged_rows(handler) == [(1.5, 3, 'scale-7')]
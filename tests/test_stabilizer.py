@@ -0,0 +1,43 @@
+from src.stabilizer import WeightStabilizer
+
+def make_stabilizer(**threshold):
+    return WeightStabilizer({'threshold': dict({'weight': 10, 'stable_readings': 3, 'stable_stddev': 0.05,
+                                                'rearm_weight': 1}, **threshold)})
+
+def feed(stabilizer, weights):
+    return [stabilizer.add(weight, i) for i, weight in enumerate(weights)]
+
+def test_settles_once_per_placement():
+    stabilizer = make_stabilizer()
+    results = feed(stabilizer, [5, 12, 20, 20.02, 20.01, 19.99, 20, 20.01])
+    settled = [result for result in results if result is not None]
+    assert len(settled) == 1
+    weight, timestamp = settled[0]
+    assert abs(weight - 20.01) < 1e-9 and timestamp == 4
+
+def test_unsettled_readings_do_not_trigger():
+    stabilizer = make_stabilizer()
+    assert feed(stabilizer, [15, 20, 25, 30, 35]) == [None] * 5
+
+def test_rearms_only_after_the_scale_empties():
+    stabilizer = make_stabilizer()
+    feed(stabilizer, [20, 20, 20])
+    #the load shifts but never leaves the scale, that is still the same placement
+    assert feed(stabilizer, [5, 30, 30, 30]) == [None] * 4
+    assert stabilizer.add(0.5, 10) is None
+    assert feed(stabilizer, [30, 30, 30])[-1] == (30.0, 2)
+
+def test_threshold_is_read_on_every_reading():
+    config = {'threshold': {'weight': 10, 'stable_readings': 2, 'rearm_weight': 1}}
+    stabilizer = WeightStabilizer(config)
+    assert feed(stabilizer, [8, 8]) == [None, None]
+    config['threshold']['weight'] = 5
+    assert feed(stabilizer, [8, 8])[-1] == (8.0, 1)
+
+def test_single_reading_triggers_by_default():
+    #scales that publish one settled value per placement, like test/weight_dummy_publisher.py
+    stabilizer = WeightStabilizer({'threshold': {'weight': 10, 'rearm_weight': 1}})
+    assert stabilizer.add(20, 0) == (20.0, 0)
+    assert stabilizer.add(25, 1) is None
+    assert stabilizer.add(0, 2) is None
+    assert stabilizer.add(25, 3) == (25.0, 3)
@@ -0,0 +1,56 @@
+import os
+import time
+from datetime import datetime
+from src.storage import RetentionManager, shard_directory, thumbnail_path
+
+DAY = 86400
+
+def save(output_dir, name, when, age, size=400):
+    #an image and its thumbnail, last accessed age seconds ago
+    directory = shard_directory(str(output_dir), when)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, name)
+    for file_path in (path, thumbnail_path(path)):
+        with open(file_path, 'wb') as file:
+            file.write(b'x' * (size // 2))
+        stamp = time.time() - age
+        os.utime(file_path, (stamp, stamp))
+    return path
+
+def test_least_recently_used_images_go_first_when_over_size(tmp_path):
+    old = save(tmp_path, "a.jpg", datetime(2026, 1, 1), age=300)
+    middle = save(tmp_path, "b.jpg", datetime(2026, 1, 2), age=200)
+    new = save(tmp_path, "c.jpg", datetime(2026, 1, 2), age=100)
+    #room for two images and their thumbnails
+    manager = RetentionManager(str(tmp_path), max_size_mb=900 / (1024 * 1024))
+    manager.scan()
+    assert not os.path.exists(old) and not os.path.exists(thumbnail_path(old))
+    assert os.path.exists(middle) and os.path.exists(new)
+    #the emptied day, month and year directories are removed too
+    assert not os.path.exists(os.path.join(str(tmp_path), "2026", "01", "01"))
+    assert os.path.exists(os.path.join(str(tmp_path), "2026", "01", "02"))
+
+def test_images_past_max_age_are_removed(tmp_path):
+    old = save(tmp_path, "a.jpg", datetime(2026, 1, 1), age=3 * DAY)
+    new = save(tmp_path, "b.jpg", datetime(2026, 1, 3), age=100)
+    manager = RetentionManager(str(tmp_path), max_age_days=2)
+    manager.scan()
+    assert not os.path.exists(old) and os.path.exists(new)
+
+def test_recently_served_image_is_kept(tmp_path):
+    served = save(tmp_path, "a.jpg", datetime(2026, 1, 1), age=300)
+    middle = save(tmp_path, "b.jpg", datetime(2026, 1, 1), age=200)
+    manager = RetentionManager(str(tmp_path), max_size_mb=900 / (1024 * 1024))
+    manager.scan()
+    #the image server bumps the atime of what it serves
+    os.utime(served, (time.time(), os.stat(served).st_mtime))
+    new = save(tmp_path, "c.jpg", datetime(2026, 1, 2), age=0)
+    manager.add(new, 400)
+    assert os.path.exists(served) and os.path.exists(new)
+    assert not os.path.exists(middle)
+
+def test_disabled_manager_removes_nothing(tmp_path):
+    old = save(tmp_path, "a.jpg", datetime(2026, 1, 1), age=10 * DAY)
+    manager = RetentionManager(str(tmp_path))
+    manager.scan()
+    assert not manager.enabled and os.path.exists(old)
@@ -0,0 +1,58 @@
+import numpy as np
+from src.detector import Tracker, box_iou, match_boxes
+from src.inference_backends import Boxes, Results
+
+CONFIG = {'yolo': {'conf_threshold': 0.5}, 'tracking': {'low_conf': 0.1, 'match_iou': 0.3, 'max_age': 3}}
+
+def frame(*boxes):
+    #boxes as (x center, y center, conf), 40 px squares in full frame coordinates
+    data = np.array([[x - 20, y - 20, x + 20, y + 20, conf, 0] for x, y, conf in boxes], dtype=np.float32)
+    return Results(Boxes(data.reshape(-1, 6)), (480, 640))
+
+def walk(tracker, start, end, steps, y=240, conf=0.9):
+    counts = None
+    for x in np.linspace(start, end, steps):
+        counts = tracker.update(frame((x, y, conf)))
+    return counts
+
+def test_bird_walking_through_the_circle_enters_and_leaves():
+    tracker = Tracker((320, 240), 100, CONFIG)
+    counts = walk(tracker, 120, 320, 21)
+    assert (counts['entered'], counts['left'], counts['inside'], counts['unique']) == (1, 0, 1, 1)
+    counts = walk(tracker, 320, 520, 21)
+    assert (counts['entered'], counts['left'], counts['inside'], counts['unique']) == (1, 1, 0, 1)
+
+def test_bird_first_seen_inside_is_placed_not_entered():
+    tracker = Tracker((320, 240), 100, CONFIG)
+    counts = walk(tracker, 320, 330, 3)
+    assert (counts['entered'], counts['left'], counts['unique']) == (0, 0, 1)
+    counts = walk(tracker, 330, 520, 20)
+    assert (counts['entered'], counts['left']) == (0, 1)
+
+def test_bird_stepping_out_and_back_is_counted_once():
+    tracker = Tracker((320, 240), 100, CONFIG)
+    walk(tracker, 150, 320, 18)
+    walk(tracker, 320, 150, 18)
+    counts = walk(tracker, 150, 320, 18)
+    assert (counts['entered'], counts['left'], counts['unique']) == (2, 1, 1)
+
+def test_weak_detections_keep_a_track_alive():
+    tracker = Tracker((320, 240), 100, CONFIG)
+    walk(tracker, 120, 200, 9)
+    #below yolo.conf_threshold a detection cannot start a track, but it continues one
+    counts = walk(tracker, 210, 320, 12, conf=0.2)
+    assert (counts['entered'], counts['unique']) == (1, 1)
+    assert [track_id for track_id, _, _ in tracker.tracks()] == [1]
+
+def test_lost_track_expires_after_max_age():
+    tracker = Tracker((320, 240), 100, CONFIG)
+    walk(tracker, 300, 320, 3)
+    for _ in range(CONFIG['tracking']['max_age'] + 1):
+        tracker.update(frame())
+    assert not tracker.active.any()
+
+def test_match_boxes_prefers_the_highest_overlap():
+    tracks = np.array([[0, 0, 10, 10], [20, 0, 30, 10]], dtype=np.float32)
+    detections = np.array([[21, 0, 31, 10], [1, 0, 11, 10], [100, 100, 110, 110]], dtype=np.float32)
+    assert box_iou(tracks, detections).shape == (2, 3)
+    assert sorted(match_boxes(tracks, detections, 0.3)) == [(0, 1), (1, 0)]
@@ -1,83 +1,262 @@
 import asyncio
-import json
 from sanic import Sanic, Request, Websocket
-from sanic.response import json as json_response, file
+from sanic.response import json as json_response, raw, empty, text
+from sanic.exceptions import NotFound
 import paho.mqtt.client as mqtt
-from queue import Queue
 from threading import Thread
 import os
+import time
+from datetime import date, timedelta
+from src.config import load_config
+from src.fanout import FanOut, ReplayBuffer
+from src.mysql_handler import MYSQLHandler
+from src.stations import load_stations
+from src.image_cache import ImageCache, parse_range, variant_width
+from src.mqtt_codec import decode_events, topic_encoding
+from src.log import get_logger, setup_logging
+from src.metrics import CONTENT_TYPE, REGISTRY, counter, gauge
+from src.storage import thumbnail_path
 
 app = Sanic("WebSocketMQTTServer")
-connected_websockets = set()
-message_queue = Queue()
+setup_logging()
+log = get_logger('websocket_server')
+# The directory main.py saves images in, image URLs are paths relative to it
+OUTPUT_DIR = load_config()['output']['directory']
+CLIENT_QUEUE_SIZE = 32    # Messages a client may fall behind before it is dropped
+INCOMING_QUEUE_SIZE = 1000
+REPLAY_SIZE = 100         # Recent messages replayed to newly connected clients
+fanout = FanOut(CLIENT_QUEUE_SIZE)
+replay = ReplayBuffer(REPLAY_SIZE)
+IMAGE_CACHE_MB = 32       # Memory for recently served images and resized variants
+image_cache = ImageCache(IMAGE_CACHE_MB * 1024 * 1024)
+
+# Served on /metrics, main.py exposes the pipeline metrics on its own endpoint
+EVENTS_RECEIVED = counter('smart_scale_ws_events_received_total', 'Data events received from MQTT', ['encoding'])
+EVENTS_DROPPED = counter('smart_scale_ws_events_dropped_total', 'Data events dropped because processing fell behind')
+IMAGE_REQUESTS = counter('smart_scale_ws_image_requests_total', 'Image requests by response status', ['status'])
+gauge('smart_scale_ws_clients', 'Connected websocket clients').set_function(lambda: len(fanout))
+gauge('smart_scale_ws_image_cache_entries', 'Images and variants held in memory').set_function(lambda: len(image_cache))
+# Saved images never change, so browsers may keep them for a year without asking again
+IMAGE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+message_queue = None
+
+# Latest preview JPEG per station published by main.py, streamed as MJPEG on /preview?station=<id>
+# A single-station setup publishes on preview_topic itself and is stored under ''
+preview_state = {}
+preview_condition = None
+event_loop = None
 
 # MQTT client setup
 mqtt_client = mqtt.Client()
 mqtt_topic = "smart_scale/data"
+preview_topic = "smart_scale/preview"
 
 # MQTT callbacks
 def on_connect(client, userdata, flags, rc):
-    print(f"Connected to MQTT Broker with result code {rc}")
+    log.info("Connected to MQTT Broker with result code %s", rc)
     client.subscribe(mqtt_topic)
+    # main.py publishes on mqtt_topic/msgpack or mqtt_topic/cbor when mqtt.encoding is not json
+    client.subscribe(mqtt_topic + "/+")
+    client.subscribe(preview_topic)
+    client.subscribe(preview_topic + "/+")
 
 def on_message(client, userdata, msg):
-    print(f"Received message on topic {msg.topic}: {msg.payload.decode()}")
-    message_queue.put(msg.payload.decode())
+    if msg.topic == preview_topic or msg.topic.startswith(preview_topic + "/"):
+        # Hand the frame to the event loop, the MJPEG streams wait on a condition there
+        if event_loop is not None:
+            station = msg.topic[len(preview_topic) + 1:]
+            asyncio.run_coroutine_threadsafe(set_preview(station, msg.payload), event_loop)
+        return
+    encoding = topic_encoding(mqtt_topic, msg.topic)
+    if encoding is None:
+        return
+    try:
+        # A batched message holds several events, each is sent to clients on its own
+        events = decode_events(msg.payload, encoding)
+    except Exception as e:
+        log.warning("Invalid %s message on topic %s: %s", encoding, msg.topic, e)
+        return
+    log.info("Received %d events on topic %s (%d bytes)", len(events), msg.topic, len(msg.payload))
+    EVENTS_RECEIVED.labels(encoding).inc(len(events))
+    # Wake the event loop directly instead of having it poll a thread queue
+    if event_loop is not None:
+        for data in events:
+            event_loop.call_soon_threadsafe(enqueue_message, data)
+
+def enqueue_message(message):
+    # Runs on the event loop, drops the oldest message if processing has fallen far behind
+    if message_queue.full():
+        message_queue.get_nowait()
+        EVENTS_DROPPED.inc()
+        log.warning("Incoming message queue full, dropped oldest message")
+    message_queue.put_nowait(message)
+
+async def set_preview(station, frame):
+    async with preview_condition:
+        _, seq = preview_state.get(station, (None, 0))
+        preview_state[station] = (frame, seq + 1)
+        preview_condition.notify_all()
 
 mqtt_client.on_connect = on_connect
 mqtt_client.on_message = on_message
 
-# WebSocket route
+# WebSocket route, connect with /ws?since=<seq>&epoch=<epoch> to only replay messages after the last one seen
 @app.websocket("/ws")
 async def websocket(request: Request, ws: Websocket):
-    connected_websockets.add(ws)
+    since = request.args.get("since")
+    since = int(since) if since is not None and since.isdigit() else None
+    epoch = request.args.get("epoch")
+    epoch = int(epoch) if epoch is not None and epoch.isdigit() else None
+    fanout.add(ws, initial=replay.snapshot(since, epoch))
     try:
         async for msg in ws:
             # Here you can handle any incoming messages from the client if needed
-            print(f"Received from client: {msg}")
+            log.debug("Received from client: %s", msg)
     finally:
-        connected_websockets.remove(ws)
-
-# Broadcast function
-async def broadcast(message):
-    for ws in connected_websockets:
-        await ws.send(message)
+        fanout.remove(ws)
 
 # Message processor
 async def process_messages():
     while True:
-        while not message_queue.empty():
-            message = message_queue.get()
-            try:
-                data = json.loads(message)
-                # Extract image path and create a URL
-                image_path = data.get('image_path')
-                if image_path:
-                    # Assuming the image path is relative to the server's root
-                    image_url = f"/images/{os.path.basename(image_path)}"
-                    data['image_url'] = image_url
-                await broadcast(json.dumps(data))
-            except json.JSONDecodeError:
-                print(f"Invalid JSON received: {message}")
-        await asyncio.sleep(0.1)  # Small delay to prevent busy waiting
-
-# Route to serve images
-@app.route("/images/<filename:string>")
+        data = await message_queue.get()
+        try:
+            # Extract image path and create a URL
+            image_path = data.get('image_path')
+            if image_path:
+                # Images live under OUTPUT_DIR, either flat or sharded as YYYY/MM/DD
+                relative_path = image_url_path(image_path)
+                data['image_url'] = f"/images/{relative_path}"
+                data['thumbnail_url'] = f"/images/{thumbnail_path(relative_path)}"
+            data['type'] = 'data'
+            # Serialized once, every client's queue and the replay buffer share the same string
+            fanout.publish(replay.add(data))
+        except (AttributeError, TypeError, ValueError) as e:
+            log.warning("Invalid event received: %s: %s", data, e)
+
+# MJPEG preview stream, open http://<host>:8000/preview in a browser, add ?station=<id> with several stations
+@app.route("/preview")
+async def preview_stream(request: Request):
+    station = request.args.get("station", "")
+    response = await request.respond(content_type="multipart/x-mixed-replace; boundary=frame")
+    last_seq = 0
+    while True:
+        async with preview_condition:
+            await preview_condition.wait_for(lambda: preview_state.get(station, (None, 0))[1] != last_seq)
+            frame, last_seq = preview_state[station]
+        await response.send(b"--frame\r\nContent-Type: image/jpeg\r\n"
+                            + f"Content-Length: {len(frame)}\r\n\r\n".encode() + frame + b"\r\n")
+
+def image_url_path(image_path):
+    relative_path = os.path.relpath(image_path, OUTPUT_DIR)
+    if relative_path.startswith(".."):
+        relative_path = os.path.basename(image_path)
+    return relative_path.replace(os.sep, "/")
+
+def resolve_image_path(filename):
+    # Refuse anything that resolves outside OUTPUT_DIR, e.g. ../ segments or symlinks
+    root = os.path.realpath(OUTPUT_DIR)
+    path = os.path.realpath(os.path.join(root, filename))
+    if os.path.commonpath([root, path]) != root or not os.path.isfile(path):
+        raise NotFound(f"Image {filename} not found")
+    return path
+
+# Route to serve images, flat names and YYYY/MM/DD/name paths
+# ?w=320 serves a resized copy, Range, If-None-Match and If-Modified-Since requests are answered without resending the image
+@app.route("/images/<filename:path>")
 async def serve_image(request: Request, filename: str):
-    return await file(f"output_image/{filename}")
+    path = resolve_image_path(filename)
+    # Bump the access time so the retention manager in main.py evicts least recently viewed images first
+    try:
+        os.utime(path, (time.time(), os.stat(path).st_mtime))
+    except OSError:
+        pass
+
+    width = variant_width(request.args.get("w"))
+    try:
+        # Disk reads and resizing run in a worker thread, cache hits return right away
+        image = await asyncio.get_running_loop().run_in_executor(None, image_cache.get, path, width)
+    except OSError:
+        raise NotFound(f"Image {filename} not found")
+
+    headers = {
+        "ETag": image.etag,
+        "Last-Modified": image.last_modified,
+        "Cache-Control": IMAGE_CACHE_CONTROL,
+        "Accept-Ranges": "bytes",
+    }
+    if image.not_modified(request.headers.get("if-none-match"), request.headers.get("if-modified-since")):
+        IMAGE_REQUESTS.labels(304).inc()
+        return empty(status=304, headers=headers)
+
+    body = image.body
+    # If-Range asks for the range only while the image is still the one the client has part of
+    if_range = request.headers.get("if-range")
+    byte_range = request.headers.get("range") if not if_range or if_range == image.etag else None
+    try:
+        byte_range = parse_range(byte_range, len(body))
+    except ValueError:
+        headers["Content-Range"] = f"bytes */{len(body)}"
+        IMAGE_REQUESTS.labels(416).inc()
+        return empty(status=416, headers=headers)
+    if byte_range is None:
+        IMAGE_REQUESTS.labels(200).inc()
+        return raw(body, headers=headers, content_type=image.content_type)
+    IMAGE_REQUESTS.labels(206).inc()
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{len(body)}"
+    return raw(body[start:end + 1], status=206, headers=headers, content_type=image.content_type)
+
+# Prometheus scrape endpoint
+@app.route("/metrics")
+async def metrics(request: Request):
+    return text(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+# Today's totals so far, from the daily rollups main.py writes, None if the database cannot be read
+def load_today_totals():
+    try:
+        config = load_config()
+        device_ids = [station_id for station_id, _ in load_stations(config)]
+        mysql_handler = MYSQLHandler(config)
+        # Read only, main.py owns the schema and may be migrating it right now
+        mysql_handler.connect(migrate=False)
+        try:
+            today = date.today()
+            rows = mysql_handler.get_daily_stats(today, today + timedelta(days=1))
+        finally:
+            mysql_handler.close()
+    except Exception as e:
+        log.warning("Could not read today's totals from the database, starting from zero: %s", e)
+        return None
+    # The database may be shared with other installations, only this one's stations are counted
+    return [row for row in rows if row['device_id'] in device_ids]
 
 # Start MQTT client
 def start_mqtt_client():
     mqtt_client.connect("localhost", 1883, 60)  # Replace with your MQTT broker address
     mqtt_client.loop_forever()
 
-# Setup before server starts
-@app.listener('before_server_start')
-def setup(app, loop):
+# Seeds today's totals, then starts MQTT, so no live event is counted twice
+async def seed_and_start_mqtt():
+    # The database is read in a worker thread, a slow database does not hold up the server
+    rows = await asyncio.get_running_loop().run_in_executor(None, load_today_totals)
+    if rows is not None:
+        replay.seed(date.today(), rows)
+        log.info("Seeded today's totals with %d events from the database", replay.totals['events'])
+
     # Start MQTT client in a separate thread
     mqtt_thread = Thread(target=start_mqtt_client)
     mqtt_thread.start()
-    
+
+# Setup before server starts
+@app.listener('before_server_start')
+def setup(app, loop):
+    global event_loop, preview_condition, message_queue
+    event_loop = loop
+    preview_condition = asyncio.Condition()
+    message_queue = asyncio.Queue(maxsize=INCOMING_QUEUE_SIZE)
+
+    app.add_task(seed_and_start_mqtt())
+
     # Start the message processing task
     app.add_task(process_messages())
 